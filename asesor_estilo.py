@@ -1,10 +1,24 @@
 import re
 import json
+import hashlib
 import html
+import math
+import heapq
 import asyncio
+import time
+import threading
+import unicodedata
+from collections import Counter, defaultdict, deque
 from typing import List, Dict
-import google.generativeai as genai
 from nicegui import ui, app
+import variantes
+from cache_ttl import TTLCache
+from ejecutor_gemini import EjecutorGemini, GeminiSaturado
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
 
 ADVISOR_CSS = """
 <style>
@@ -103,56 +117,330 @@ ADVISOR_CSS = """
 """
 
 
+INVENTARIO_TTL = 120  # s; las escrituras en main lo invalidan antes
+TOP_K = 12            # piezas que viajan en cada turno
+RESPUESTAS_MAX = 256  # respuestas cacheadas (LRU)
+RESPUESTAS_TTL = 6 * 3600
+
+SYSTEM_INSTRUCTION = (
+    "Eres un asesor experto en antigüedades de la tienda 'El Jueves' en Madrid.\n"
+    "Tu función es ayudar a los clientes a encontrar muebles de nuestro inventario.\n"
+    "REGLAS:\n"
+    "1. Solo puedes recomendar muebles que aparezcan en la lista de piezas adjunta "
+    "al mensaje del cliente o que ya hayas recomendado antes con su ID\n"
+    "2. Cuando recomiendes un mueble, SIEMPRE incluye su ID con el formato exacto [ID:123]\n"
+    "3. Responde en español, tono amable y experto en antigüedades\n"
+    "4. Si no hay nada que se ajuste, dilo honestamente\n"
+    "5. Máximo 3 recomendaciones por respuesta"
+)
+
+
+# ---------- Recuperación local (BM25) ----------
+_STOP = {
+    'a', 'al', 'algo', 'con', 'de', 'del', 'el', 'en', 'es', 'esta', 'este', 'hay', 'la', 'las',
+    'lo', 'los', 'me', 'mi', 'muy', 'o', 'para', 'pero', 'por', 'que', 'se', 'si', 'sin', 'su',
+    'tambien', 'teneis', 'tiene', 'tienen', 'un', 'una', 'uno', 'unos', 'unas', 'y', 'ya',
+    'busco', 'quiero', 'gustaria', 'necesito',
+}
+
+
+def _raiz(w: str) -> str:
+    # lo justo para que singular/plural y masculino/femenino coincidan
+    if len(w) > 4 and w.endswith('es'):
+        w = w[:-2]
+    elif len(w) > 3 and w.endswith('s'):
+        w = w[:-1]
+    if len(w) > 4 and w[-1] in 'aoe':
+        w = w[:-1]
+    return w
+
+
+def tokens(texto: str | None) -> list[str]:
+    t = unicodedata.normalize('NFKD', (texto or '').lower())
+    t = ''.join(c for c in t if not unicodedata.combining(c))
+    return [_raiz(w) for w in re.findall(r'[a-z0-9]+', t) if len(w) > 1 and w not in _STOP]
+
+
+class IndiceBM25:
+    """BM25 en memoria sobre nombre (peso 3), tipo (2) y descripción (1)."""
+
+    def __init__(self, docs: List[Dict], k1: float = 1.5, b: float = 0.75):
+        self.docs = docs
+        self.k1, self.b = k1, b
+        self._tf: list[Counter] = []
+        self._len: list[int] = []
+        self._post: dict[str, list[int]] = defaultdict(list)
+        for i, d in enumerate(docs):
+            toks = tokens(d.get('nombre')) * 3 + tokens(d.get('tipo')) * 2 + tokens(d.get('descripcion'))
+            tf = Counter(toks)
+            self._tf.append(tf)
+            self._len.append(len(toks))
+            for t in tf:
+                self._post[t].append(i)
+        n = len(docs)
+        self._avg = (sum(self._len) / n) if n else 1.0
+        self._idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self._post.items()}
+
+    def buscar(self, consulta: str, k: int = TOP_K) -> List[Dict]:
+        scores: dict[int, float] = defaultdict(float)
+        for t in set(tokens(consulta)):
+            idf = self._idf.get(t)
+            if not idf:
+                continue
+            for i in self._post[t]:
+                f = self._tf[i][t]
+                norm = self.k1 * (1 - self.b + self.b * self._len[i] / (self._avg or 1.0))
+                scores[i] += idf * f * (self.k1 + 1) / (f + norm)
+        # empates: la pieza más reciente primero
+        top = heapq.nlargest(k, scores.items(), key=lambda x: (x[1], self.docs[x[0]]['id']))
+        return [self.docs[i] for i, _ in top]
+
+
+_FIN = object()
+_ID_RE = re.compile(r'\[ID:\s*(\d+)\]')
+
+
+def normalizar(texto: str | None) -> str:
+    """Minúsculas, sin tildes ni puntuación: '¿Tenéis cómodas?' == 'teneis comodas'."""
+    t = unicodedata.normalize('NFKD', (texto or '').lower())
+    t = ''.join(c for c in t if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[a-z0-9]+', t))
+
+
+def _huella(history: List[Dict]) -> str:
+    h = hashlib.sha1()
+    for m in history:
+        h.update(f"{m.get('role')}:{normalizar(m.get('content'))}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def _texto(trozo) -> str:
+    # .text lanza ValueError en trozos sin texto (p. ej. el de cierre con finish_reason)
+    try:
+        return trozo.text or ''
+    except Exception:
+        return ''
+
+
+def _modelo_gemini(system_instruction: str):
+    return genai.GenerativeModel(model_name='gemini-2.5-flash', system_instruction=system_instruction)
+
+
 class StyleAdvisor:
-    def __init__(self, gemini_api_key: str, db_pool):
+    """Asesor de estilo.
+
+    `model_factory(system_instruction)` devuelve un objeto con `start_chat(history=...)`
+    cuyo chat tiene `send_message(texto)`; por defecto Gemini. Pasar uno falso permite
+    probar el asesor sin red.
+    """
+
+    def __init__(self, gemini_api_key: str, db_pool, model_factory=None,
+                 ejecutor: EjecutorGemini | None = None):
         self.api_key = (gemini_api_key or '').strip()
         self.pool = db_pool
-        if self.api_key:
+        if self.api_key and genai is not None:
             genai.configure(api_key=self.api_key)
-        self.has_gemini = bool(self.api_key)
+        self._model_factory = model_factory or _modelo_gemini
+        self.ejecutor = ejecutor or EjecutorGemini()
+        self._en_curso: dict = {}  # clave de respuesta -> Future con el texto completo
+        self.has_gemini = model_factory is not None or (bool(self.api_key) and genai is not None)
+        # Inventario sin vender en memoria + índice BM25. `version` solo sube cuando
+        # cambia su contenido.
+        self.version = 0
+        self._docs: List[Dict] | None = None
+        self._indice: IndiceBM25 | None = None
+        self._snapshot_ts = 0.0
+        self._gen = 0            # escrituras vistas; invalida una carga en curso
+        self._snapshot_gen = -1
+        self._lock = asyncio.Lock()
+        self._model = None
+        # (mensaje normalizado, huella del historial, versión del inventario) -> (texto, ids)
+        self._respuestas = TTLCache(maxsize=RESPUESTAS_MAX, ttl=RESPUESTAS_TTL)
+        self._ttft: deque = deque(maxlen=200)
+        self._total: deque = deque(maxlen=200)
 
     def _pool(self):
         return self.pool or getattr(app.state, 'pool', None)
 
-    async def get_inventory_json(self) -> str:
-        pool = self._pool()
-        if not pool:
-            return "[]"
-        async with pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT id, nombre, tipo, precio, descripcion, tienda
-                FROM muebles
-                WHERE vendido = FALSE
-                ORDER BY id DESC
-                LIMIT 100
-            """)
-        return json.dumps([dict(r) for r in rows], default=str, ensure_ascii=False)
+    def invalidar_inventario(self, retirados=()):
+        """Llamar tras cualquier escritura en muebles: la próxima consulta recarga.
 
-    async def chat(self, user_message: str, history: List[Dict]) -> str:
-        if not self.has_gemini:
-            return "El asesor no está disponible en este momento."
-        inventory = await self.get_inventory_json()
-        system_instruction = (
-            "Eres un asesor experto en antigüedades de la tienda 'El Jueves' en Madrid.\n"
-            "Tu función es ayudar a los clientes a encontrar muebles de nuestro inventario.\n"
-            "REGLAS:\n"
-            f"1. Solo puedes recomendar muebles que aparezcan en este inventario: {inventory}\n"
-            "2. Cuando recomiendes un mueble, SIEMPRE incluye su ID con el formato exacto [ID:123]\n"
-            "3. Responde en español, tono amable y experto en antigüedades\n"
-            "4. Si no hay nada que se ajuste, dilo honestamente\n"
-            "5. Máximo 3 recomendaciones por respuesta"
-        )
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            system_instruction=system_instruction,
-        )
+        `retirados`: ids vendidos o borrados; se olvidan las respuestas que los recomiendan.
+        """
+        self._gen += 1
+        retirados = set(retirados)
+        if retirados:
+            self._respuestas.invalidate_where(
+                lambda k: bool(self._respuestas.peek(k, ('', frozenset()))[1] & retirados))
+
+    def _vigente(self) -> bool:
+        return (self._indice is not None and self._snapshot_gen == self._gen
+                and time.monotonic() - self._snapshot_ts < INVENTARIO_TTL)
+
+    async def indice(self) -> IndiceBM25:
+        """Índice de todas las piezas sin vender (cacheado, ver INVENTARIO_TTL)."""
+        if self._vigente():
+            return self._indice
+        async with self._lock:
+            if self._vigente():
+                return self._indice
+            pool = self._pool()
+            if not pool:
+                return IndiceBM25([])
+            gen = self._gen
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, nombre, tipo, precio, descripcion, tienda
+                    FROM muebles
+                    WHERE vendido = FALSE
+                    ORDER BY id DESC
+                """)
+            docs = [dict(r) for r in rows]
+            if docs != self._docs:
+                self.version += 1
+                self._docs = docs
+                self._indice = IndiceBM25(docs)
+            self._snapshot_ts = time.monotonic()
+            self._snapshot_gen = gen
+            return self._indice
+
+    async def candidatas(self, user_message: str, history: List[Dict], k: int = TOP_K) -> List[Dict]:
+        """Las `k` piezas más afines a la consulta (y a la pregunta anterior del cliente)."""
+        indice = await self.indice()
+        previa = next((m.get('content', '') for m in reversed(history) if m.get('role') == 'user'), '')
+        top = indice.buscar(user_message, k)
+        if len(top) < k and previa:
+            vistos = {d['id'] for d in top}
+            top += [d for d in indice.buscar(previa, k) if d['id'] not in vistos][:k - len(top)]
+        if not top:
+            top = indice.docs[:k]  # nada encaja: las más recientes
+        return top
+
+    def _modelo(self):
+        if self._model is None:
+            self._model = self._model_factory(SYSTEM_INSTRUCTION)
+        return self._model
+
+    def _mensaje(self, user_message: str, piezas: List[Dict]) -> str:
+        return (f"{user_message}\n\n[Piezas del inventario para esta consulta: "
+                f"{json.dumps(piezas, default=str, ensure_ascii=False)}]")
+
+    def _chat(self, history: List[Dict]):
         formatted_history = []
         for m in history:
             role = "user" if m.get("role") == "user" else "model"
             formatted_history.append({"role": role, "parts": [m.get("content", "")]})
-        chat = model.start_chat(history=formatted_history)
-        resp = await asyncio.to_thread(chat.send_message, user_message)
-        return (getattr(resp, 'text', '') or '').strip()
+        return self._modelo().start_chat(history=formatted_history)
+
+    async def chat(self, user_message: str, history: List[Dict]) -> str:
+        partes = [t async for t in self.chat_stream(user_message, history)]
+        return ''.join(partes).strip()
+
+    async def chat_stream(self, user_message: str, history: List[Dict]):
+        """Respuesta en trozos según los genera el modelo.
+
+        `send_message(stream=True)` es bloqueante: se itera en un hilo del ejecutor de
+        Gemini que pasa cada trozo a una asyncio.Queue. Registra el tiempo hasta el
+        primer trozo (TTFT).
+        """
+        if not self.has_gemini:
+            yield "El asesor no está disponible en este momento."
+            return
+        t0 = time.perf_counter()
+        await self.indice()  # fija self.version para la clave
+        clave = (normalizar(user_message), _huella(history), self.version)
+        cacheada = self._respuestas.get(clave)
+        while cacheada is None and clave in self._en_curso:
+            # la misma pregunta ya se está generando: esperamos a esa respuesta
+            fut = self._en_curso[clave]
+            try:
+                cacheada = (await asyncio.shield(fut), None)
+                self.ejecutor.coalescidas += 1
+            except asyncio.CancelledError:
+                if not fut.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # quien la generaba se fue a medias: la generamos nosotros (o esperamos al siguiente)
+        if cacheada is not None:
+            self._registrar(time.perf_counter() - t0, time.perf_counter() - t0)
+            yield cacheada[0]
+            return
+
+        loop = asyncio.get_running_loop()
+        en_curso = loop.create_future()
+        en_curso.add_done_callback(lambda f: f.cancelled() or f.exception())  # sin avisos si nadie espera
+        self._en_curso[clave] = en_curso
+        cola: asyncio.Queue = asyncio.Queue()
+        parar = threading.Event()
+        ttft, partes = None, []
+        try:
+            mensaje = self._mensaje(user_message, await self.candidatas(user_message, history))
+            chat = self._chat(history)
+            emitido = False
+
+            def producir():
+                nonlocal emitido
+                try:
+                    for trozo in chat.send_message(mensaje, stream=True):
+                        if parar.is_set():
+                            break
+                        texto = _texto(trozo)
+                        if texto:
+                            emitido = True
+                            loop.call_soon_threadsafe(cola.put_nowait, texto)
+                except Exception as e:
+                    if emitido:  # a medias no se puede reintentar sin duplicar texto
+                        raise RuntimeError(f'Respuesta interrumpida: {e}') from e
+                    raise
+
+            def terminado(f: asyncio.Future):
+                cola.put_nowait(_FIN if f.cancelled() or f.exception() is None else f.exception())
+
+            hilo = asyncio.ensure_future(self.ejecutor.ejecutar(producir))
+            hilo.add_done_callback(terminado)
+            while (item := await cola.get()) is not _FIN:
+                if isinstance(item, Exception):
+                    raise item
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                partes.append(item)
+                yield item
+            texto = ''.join(partes).strip()
+            en_curso.set_result(texto)
+            if texto:  # solo respuestas completas
+                ids = frozenset(int(x) for x in _ID_RE.findall(texto))
+                self._respuestas.set(clave, (texto, ids))
+        except (GeneratorExit, asyncio.CancelledError):
+            # nos vamos nosotros, no ha fallado nada: quien esperaba lo genera por su cuenta
+            en_curso.cancel()
+            raise
+        except Exception as e:
+            if not en_curso.done():
+                en_curso.set_exception(e)  # errores reales del modelo: también para quien espera
+            raise
+        finally:
+            parar.set()  # si el consumidor se va antes, el hilo deja de leer
+            if self._en_curso.get(clave) is en_curso:
+                del self._en_curso[clave]
+            self._registrar(ttft, time.perf_counter() - t0)
+
+    def _registrar(self, ttft: float | None, total: float):
+        if ttft is not None:
+            self._ttft.append(ttft)
+        self._total.append(total)
+
+    def metricas(self) -> dict:
+        """TTFT y duración total (ms) de los últimos turnos."""
+        def pct(valores, p):
+            if not valores:
+                return None
+            v = sorted(valores)
+            return round(v[min(len(v) - 1, int(p * len(v)))] * 1000)
+        return {
+            'turnos': len(self._total),
+            'ttft_ms_p50': pct(self._ttft, 0.5), 'ttft_ms_p95': pct(self._ttft, 0.95),
+            'total_ms_p50': pct(self._total, 0.5), 'total_ms_p95': pct(self._total, 0.95),
+            'respuestas': self._respuestas.stats(),
+        }
 
     async def fetch_muebles(self, ids: List[int]) -> List[Dict]:
         pool = self._pool()
@@ -160,7 +448,16 @@ class StyleAdvisor:
             return []
         async with pool.acquire() as conn:
             rows = await conn.fetch(
-                "SELECT id, nombre, precio FROM muebles WHERE id = ANY($1::int[]) AND vendido = FALSE",
+                """
+                SELECT m.id, m.nombre, m.precio, i.imagen_url, i.variantes
+                FROM muebles m
+                LEFT JOIN LATERAL (
+                    SELECT imagen_url, variantes FROM imagenes_muebles
+                    WHERE mueble_id = m.id AND imagen_url IS NOT NULL
+                    ORDER BY es_principal DESC, id ASC LIMIT 1
+                ) i ON TRUE
+                WHERE m.id = ANY($1::int[]) AND m.vendido = FALSE
+                """,
                 ids,
             )
         return [dict(r) for r in rows]
@@ -190,32 +487,52 @@ def advisor_chat_ui(advisor: StyleAdvisor):
                 .props('borderless dense').classes('flex-1')
             send_btn = ui.button(icon='send').props('round flat')
 
-    async def render_message(role: str, text: str):
+    def render_user(text: str):
         with messages:
-            if role == 'user':
-                with ui.row().classes('w-full'):
-                    ui.html(f'<div class="msg-user">{html.escape(text)}</div>')
-            else:
-                with ui.column().classes('w-full gap-2 items-start'):
-                    clean = re.sub(r'\[ID:\s*(\d+)\]', r'#\1', text)
-                    body = html.escape(clean).replace('\n', '<br>')
-                    ui.html(f'<div class="msg-ai">{body}</div>')
-                    ids = [int(x) for x in re.findall(r'\[ID:\s*(\d+)\]', text)]
-                    if ids:
-                        muebles = await advisor.fetch_muebles(ids)
-                        if muebles:
-                            with ui.row().classes('gap-3 mt-1 overflow-x-auto pb-2'):
-                                for m in muebles:
-                                    mid = m['id']
-                                    card = ui.element('div').classes('advisor-card')
-                                    card.on('click', lambda _e, _id=mid: ui.navigate.to(f'/?id={_id}'))
-                                    with card:
-                                        ui.html(f'<img class="advisor-card-img" src="/img/{mid}?thumb=1" alt="">')
-                                        with ui.element('div').classes('advisor-card-body'):
-                                            ui.html(f'<div class="advisor-card-name">{html.escape(str(m["nombre"]))}</div>')
-                                            ui.html(f'<div class="advisor-card-price">{html.escape(str(m["precio"]))} €</div>')
+            with ui.row().classes('w-full'):
+                ui.html(f'<div class="msg-user">{html.escape(text)}</div>')
         scroll.scroll_to(percent=1.0)
 
+    def cuerpo_ai(text: str) -> str:
+        clean = _ID_RE.sub(lambda mo: f'#{mo.group(1)}', text)
+        return f'<div class="msg-ai">{html.escape(clean).replace(chr(10), "<br>")}</div>'
+
+    def render_cards(row, muebles: List[Dict]):
+        with row:
+            for m in muebles:
+                mid = m['id']
+                card = ui.element('div').classes('advisor-card')
+                card.on('click', lambda _e, _id=mid: ui.navigate.to(f'/?id={_id}'))
+                with card:
+                    src = m.get('imagen_url') or f'/img/{mid}?thumb=1'
+                    ss = variantes.srcset(m.get('imagen_url'), variantes.parse(m.get('variantes')))
+                    ss_attr = f' srcset="{html.escape(ss)}" sizes="180px"' if ss else ''
+                    ui.html(f'<img class="advisor-card-img" src="{html.escape(src)}"{ss_attr} alt="">')
+                    with ui.element('div').classes('advisor-card-body'):
+                        ui.html(f'<div class="advisor-card-name">{html.escape(str(m["nombre"]))}</div>')
+                        ui.html(f'<div class="advisor-card-price">{html.escape(str(m["precio"]))} €</div>')
+
+    async def render_reply_stream(text_user: str, ctx: List[Dict]) -> str:
+        """Pinta la respuesta según llega; las fichas aparecen en cuanto sale su [ID:n]."""
+        with messages:
+            with ui.column().classes('w-full gap-2 items-start'):
+                burbuja = ui.html(cuerpo_ai(''))
+                burbuja.set_visibility(False)
+                cards = ui.row().classes('gap-3 mt-1 overflow-x-auto pb-2')
+        texto, vistos = '', set()
+        async for trozo in advisor.chat_stream(text_user, ctx):
+            if not texto:
+                loading.set_visibility(False)
+                burbuja.set_visibility(True)
+            texto += trozo
+            burbuja.set_content(cuerpo_ai(texto))
+            nuevos = [int(x) for x in _ID_RE.findall(texto) if int(x) not in vistos]
+            if nuevos:
+                vistos.update(nuevos)
+                render_cards(cards, await advisor.fetch_muebles(list(dict.fromkeys(nuevos))))
+            scroll.scroll_to(percent=1.0)
+        return texto.strip()
+
     async def send():
         text = (user_input.value or '').strip()
         if not text:
@@ -225,12 +542,14 @@ def advisor_chat_ui(advisor: StyleAdvisor):
         user_input.disable()
         loading.set_visibility(True)
         try:
-            await render_message('user', text)
+            render_user(text)
             ctx = history[-6:]
-            reply = await advisor.chat(text, ctx)
+            reply = await render_reply_stream(text, ctx)
             history.append({"role": "user", "content": text})
             history.append({"role": "assistant", "content": reply})
-            await render_message('assistant', reply)
+        except GeminiSaturado:
+            ui.notify('El asesor está atendiendo muchas consultas; pruebe de nuevo en unos segundos',
+                      type='warning')
         except Exception as e:
             ui.notify(f'Error: {e}', type='negative')
         finally:
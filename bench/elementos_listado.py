@@ -0,0 +1,111 @@
+"""
+Elementos NiceGUI que crea el listado para una tanda de 30 muebles.
+
+Pinta `pintar_listado(rows=[...])` con filas falsas (3 fotos cada una) en un
+cliente sin servidor y cuenta los elementos creados. Con --comparar REV repite
+la medida sobre el árbol de esa revisión de git (p. ej. la anterior a las cards
+ligeras) en un proceso aparte.
+
+    python bench/elementos_listado.py
+    python bench/elementos_listado.py --comparar 0b3bba7^
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import asynccontextmanager
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Conn:
+    async def fetch(self, *a):
+        return []
+
+    async def fetchrow(self, *a):
+        return None
+
+    async def fetchval(self, *a):
+        return 0
+
+    async def execute(self, *a):
+        return None
+
+
+class _Pool:
+    @asynccontextmanager
+    async def acquire(self):
+        yield _Conn()
+
+
+def _fila(mid: int) -> dict:
+    return {
+        'id': mid, 'nombre': f'Cómoda {mid}', 'precio': 100 + mid, 'descripcion': 'Nogal, buen estado',
+        'tienda': 'El Rastro', 'tipo': 'Cómodas', 'fecha': None, 'vendido': False, 'destacado': False,
+        'alto': 80, 'largo': 120, 'fondo': 50, 'diametro': None, 'diametro_base': None,
+        'diametro_boca': None, 'alto_respaldo': None, 'alto_asiento': None, 'ancho': None,
+        'imagenes': [f'https://r2.example/{mid}_{i}.webp' for i in range(3)],
+        'imagenes_var': ['160,360,720,1200'] * 3, 'n_imagenes': 3,
+    }
+
+
+def medir(raiz: str, filas: int, admin: bool) -> dict:
+    sys.path.insert(0, raiz)
+    os.chdir(raiz)
+    import main
+    from nicegui import Client
+    from nicegui.page import page
+
+    main.app.state.pool = _Pool()
+    main.is_admin = lambda: admin
+
+    async def pintar():
+        cliente = Client(page('/'), request=None)
+        with cliente:
+            antes = len(cliente.elements)
+            tracemalloc.start()
+            await main.pintar_listado(rows=[_fila(i) for i in range(filas, 0, -1)],
+                                      base_origin='https://example.test')
+            memoria = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        return {'elementos': len(cliente.elements) - antes, 'memoria_kb': round(memoria / 1024)}
+    return asyncio.run(pintar())
+
+
+def _en_revision(rev: str, filas: int, admin: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        archivo = subprocess.run(['git', '-C', RAIZ, 'archive', rev], check=True, capture_output=True).stdout
+        subprocess.run(['tar', '-x', '-C', tmp], input=archivo, check=True)
+        res = subprocess.run([sys.executable, os.path.abspath(__file__), '--medir', tmp,
+                              '--filas', str(filas)] + (['--admin'] if admin else []),
+                             capture_output=True, text=True)
+    if res.returncode:
+        sys.exit(f'{rev}: no se pudo medir\n{res.stderr}')
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def _main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--filas', type=int, default=30)
+    ap.add_argument('--admin', action='store_true', help='pintar como administrador')
+    ap.add_argument('--comparar', metavar='REV')
+    ap.add_argument('--medir', metavar='DIR', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.filas, args.admin)))
+        return
+    ahora = _en_revision('HEAD', args.filas, args.admin) if args.comparar else medir(RAIZ, args.filas, args.admin)
+    print(f"HEAD: {ahora['elementos']} elementos, {ahora['memoria_kb']} KiB ({args.filas} filas)")
+    if args.comparar:
+        antes = _en_revision(args.comparar, args.filas, args.admin)
+        print(f"{args.comparar}: {antes['elementos']} elementos, {antes['memoria_kb']} KiB")
+        print(f"diferencia: {ahora['elementos'] - antes['elementos']:+d} elementos "
+              f"({ahora['elementos'] / antes['elementos']:.0%} de antes)")
+
+
+if __name__ == '__main__':
+    _main()
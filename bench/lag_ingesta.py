@@ -0,0 +1,119 @@
+"""
+Latencia del event loop mientras se ingieren las fotos de un mueble.
+
+Un ticker pide dormir 10 ms en bucle y anota cuánto se retrasa cada despertar
+mientras `_ingest_images` codifica y "sube" N fotos. R2 se sustituye por un
+`_r2_put` que duerme (red simulada) y la BD por un pool falso en memoria.
+
+    python bench/lag_ingesta.py                 # pipeline actual (procesos + hilos)
+    python bench/lag_ingesta.py --en-el-loop    # como antes: todo en el event loop
+
+Opciones: --fotos N (6), --ancho px (3000), --red-ms (40).
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from nicegui import run  # noqa: E402
+
+import main  # noqa: E402
+
+
+class _Conn:
+    def __init__(self):
+        self._n = 0
+
+    async def fetchval(self, sql, *args):
+        self._n += 1
+        return self._n
+
+    async def execute(self, sql, *args):
+        return None
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class _Pool:
+    @asynccontextmanager
+    async def acquire(self):
+        yield _Conn()
+
+    async def execute(self, sql, *args):
+        return None
+
+
+def _foto(ancho: int) -> bytes:
+    alto = ancho * 3 // 4
+    ruido = [Image.effect_noise((ancho, alto), 40 + 10 * i) for i in range(3)]
+    buf = BytesIO()
+    Image.merge('RGB', ruido).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+async def _ticker(parar: asyncio.Event, retrasos: list, periodo: float = 0.01):
+    loop = asyncio.get_running_loop()
+    t = loop.time()
+    while not parar.is_set():
+        await asyncio.sleep(periodo)
+        ahora = loop.time()
+        retrasos.append(ahora - t - periodo)
+        t = ahora
+
+
+async def medir(fotos: list[bytes], red_ms: float, en_el_loop: bool) -> dict:
+    main.app.state.pool = _Pool()
+    main._r2_put = lambda key, data, mime: time.sleep(red_ms / 1000)
+    if en_el_loop:
+        async def directo(fn, *a, **kw):
+            return fn(*a, **kw)
+        run.cpu_bound = run.io_bound = directo
+    else:
+        run.process_pool_start_method = 'fork'  # el worker hereda main ya importado
+        run.setup()
+
+    parar, retrasos = asyncio.Event(), []
+    tick = asyncio.create_task(_ticker(parar, retrasos))
+    t0 = time.perf_counter()
+    subidas = await main._ingest_images(1, fotos, first_principal=True)
+    total = time.perf_counter() - t0
+    parar.set()
+    await tick
+    ms = sorted(r * 1000 for r in retrasos)
+    return {
+        'subidas': subidas,
+        'total_s': round(total, 2),
+        'ticks': len(ms),  # a 10 ms, lo esperado es ~total_s * 100
+        'lag_ms_p50': round(statistics.median(ms), 1),
+        'lag_ms_p95': round(ms[max(0, math.ceil(0.95 * len(ms)) - 1)], 1),
+        'lag_ms_max': round(ms[-1], 1),
+    }
+
+
+def _main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--fotos', type=int, default=6)
+    ap.add_argument('--ancho', type=int, default=3000)
+    ap.add_argument('--red-ms', type=float, default=40)
+    ap.add_argument('--en-el-loop', action='store_true')
+    args = ap.parse_args()
+    fotos = [_foto(args.ancho) for _ in range(args.fotos)]
+    res = asyncio.run(medir(fotos, args.red_ms, args.en_el_loop))
+    modo = 'en el loop' if args.en_el_loop else 'procesos + hilos'
+    print(f"{args.fotos} fotos de {args.ancho}px ({modo}): " + ', '.join(f'{k}={v}' for k, v in res.items()))
+    if run.process_pool is not None:
+        run.process_pool.shutdown()
+
+
+if __name__ == '__main__':
+    _main()
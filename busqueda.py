@@ -0,0 +1,80 @@
+"""
+Búsqueda de muebles por texto.
+
+- Texto completo en español sobre nombre (peso A), tipo (B) y descripción (C).
+- pg_trgm sobre el nombre para tolerar erratas y búsquedas parciales.
+- unaccent en ambos lados: "comoda" encuentra "Cómoda".
+
+Si la BD no deja crear las extensiones, `preparar()` deja HABILITADA=False y
+`condicion()` vuelve al LIKE sobre el nombre de siempre.
+"""
+
+HABILITADA = False
+
+# unaccent() no es IMMUTABLE: el envoltorio permite usarlo en índices de expresión
+_SCHEMA_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """,
+]
+
+
+def _tsv(alias: str = '') -> str:
+    # Debe coincidir carácter a carácter con el del índice para que el planner lo use
+    return (
+        f"(setweight(to_tsvector('spanish', f_unaccent(coalesce({alias}nombre, ''))), 'A') || "
+        f"setweight(to_tsvector('spanish', f_unaccent(coalesce({alias}tipo, ''))), 'B') || "
+        f"setweight(to_tsvector('spanish', f_unaccent(coalesce({alias}descripcion, ''))), 'C'))"
+    )
+
+
+def _nombre_norm(alias: str = '') -> str:
+    return f"f_unaccent(lower({alias}nombre))"
+
+
+async def preparar(conn):
+    """Crea extensiones, función e índices (idempotente). Llamar una vez al arrancar."""
+    global HABILITADA
+    try:
+        for sql in _SCHEMA_SQL:
+            await conn.execute(sql)
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS idx_muebles_busqueda_tsv ON muebles USING GIN ({_tsv()})")
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_muebles_nombre_trgm ON muebles USING GIN (({_nombre_norm()}) gin_trgm_ops)"
+        )
+        HABILITADA = True
+    except Exception as e:
+        HABILITADA = False
+        print(f"[busqueda] sin texto completo/trigramas, se usa LIKE: {type(e).__name__}: {e}")
+
+
+def condicion(term: str, params: list, alias: str = '') -> str:
+    """Predicado WHERE para `term`; añade a `params` lo que necesite."""
+    term = (term or '').strip()
+    if not HABILITADA:
+        params.append(f'%{term.lower()}%')
+        return f'LOWER({alias}nombre) LIKE ${len(params)}'
+    params.append(term)
+    p = f'${len(params)}'
+    return (
+        f"({_tsv(alias)} @@ websearch_to_tsquery('spanish', f_unaccent({p})) "
+        f"OR {_nombre_norm(alias)} LIKE '%' || f_unaccent(lower({p})) || '%' "
+        f"OR f_unaccent(lower({p})) <% {_nombre_norm(alias)})"
+    )
+
+
+def ranking(term: str | None, params: list, alias: str = '') -> str:
+    """Expresión de relevancia (mayor = mejor) para ordenar resultados de `term`."""
+    term = (term or '').strip()
+    if not term or not HABILITADA:
+        return '0::real'
+    params.append(term)
+    p = f'${len(params)}'
+    return (
+        f"(ts_rank({_tsv(alias)}, websearch_to_tsquery('spanish', f_unaccent({p}))) "
+        f"+ word_similarity(f_unaccent(lower({p})), {_nombre_norm(alias)}))::real"
+    )
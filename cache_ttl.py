@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """Mapa en memoria acotado (LRU) con caducidad por entrada y contadores de aciertos."""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, self._MISSING)
+        if item is self._MISSING:
+            self.misses += 1
+            return default
+        expira, value = item
+        if expira < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Valor sin tocar contadores ni el orden LRU (aunque haya caducado)."""
+        item = self._data.get(key, self._MISSING)
+        return default if item is self._MISSING else item[1]
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, pred: Callable[[Hashable], bool]) -> int:
+        """Borra las claves que cumplan `pred`; devuelve cuántas se han borrado."""
+        keys = [k for k in self._data if pred(k)]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,71 @@
+"""
+Cliente HTTP asíncrono compartido para lecturas salientes (p. ej. imágenes de R2).
+
+Un solo httpx.AsyncClient con keep-alive, timeouts, reintentos con backoff
+exponencial (errores de red, 429 y 5xx) y un tope de peticiones simultáneas.
+`transport` permite apuntarlo a un servidor local o a un httpx.MockTransport.
+"""
+import asyncio
+import random
+
+import httpx
+
+REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+class Descargador:
+    def __init__(self, *, max_concurrencia: int = 8, timeout: float = 10.0,
+                 reintentos: int = 3, backoff: float = 0.5, max_conexiones: int = 20,
+                 user_agent: str = 'inventario-el-jueves/1.0', transport=None):
+        self.max_concurrencia = max_concurrencia
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.max_conexiones = max_conexiones
+        self.user_agent = user_agent
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._sem = asyncio.Semaphore(max_concurrencia)
+
+    def _cliente(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_conexiones,
+                                    max_keepalive_connections=self.max_conexiones),
+                headers={'User-Agent': self.user_agent},
+                follow_redirects=True,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _espera(self, intento: int):
+        # exponencial con jitter para no sincronizar reintentos de varias peticiones
+        await asyncio.sleep(self.backoff * (2 ** intento) * (0.5 + random.random()))
+
+    async def get(self, url: str) -> httpx.Response:
+        """GET con reintentos. Lanza httpx.HTTPError si al final no hay 2xx."""
+        for intento in range(self.reintentos + 1):
+            ultimo = intento == self.reintentos
+            try:
+                async with self._sem:
+                    resp = await self._cliente().get(url)
+            except httpx.TransportError:
+                if ultimo:
+                    raise
+                await self._espera(intento)
+                continue
+            if resp.status_code in REINTENTABLES and not ultimo:
+                await self._espera(intento)
+                continue
+            resp.raise_for_status()
+            return resp
+        raise AssertionError('inalcanzable')
+
+    async def get_bytes(self, url: str) -> bytes:
+        return (await self.get(url)).content
+
+    async def cerrar(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
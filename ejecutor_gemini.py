@@ -0,0 +1,116 @@
+"""
+Ejecutor propio para las llamadas bloqueantes a Gemini.
+
+- Hilos dedicados (no el pool por defecto que comparten NiceGUI y asyncio.to_thread)
+  y un tope de llamadas simultáneas.
+- Quien no consigue turno en `espera_max` segundos recibe GeminiSaturado.
+- Los errores de límite de cuota (429) se reintentan con backoff exponencial.
+- Peticiones idénticas en curso (misma `clave`) comparten un único resultado.
+- `metricas()` da profundidad de la cola y tiempos de espera.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+class GeminiSaturado(TimeoutError):
+    pass
+
+
+def es_limite_cuota(e: Exception) -> bool:
+    # google.api_core: ResourceExhausted / TooManyRequests (code 429); sin importar el paquete
+    if type(e).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    return getattr(e, 'code', None) == 429 or getattr(e, 'status_code', None) == 429
+
+
+class EjecutorGemini:
+    def __init__(self, *, max_concurrencia: int = 4, espera_max: float = 20.0,
+                 reintentos: int = 3, backoff: float = 1.0):
+        self.max_concurrencia = max_concurrencia
+        self.espera_max = espera_max
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self._hilos = ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix='gemini')
+        self._sem = asyncio.Semaphore(max_concurrencia)
+        self._en_curso: dict = {}
+        # métricas
+        self.esperando = 0
+        self.activas = 0
+        self.llamadas = 0
+        self.rechazadas = 0
+        self.reintentadas = 0
+        self.coalescidas = 0
+        self._esperas: deque = deque(maxlen=500)
+
+    async def ejecutar(self, fn, *args, clave=None):
+        """Ejecuta `fn(*args)` en un hilo del ejecutor y devuelve su resultado."""
+        if clave is None:
+            return await self._ejecutar(fn, *args)
+        fut = self._en_curso.get(clave)
+        if fut is not None:
+            self.coalescidas += 1
+        else:
+            fut = asyncio.ensure_future(self._ejecutar(fn, *args))
+            self._en_curso[clave] = fut
+            fut.add_done_callback(lambda _f: self._en_curso.pop(clave, None))
+        # shield: si un interesado se cancela, los demás siguen esperando el resultado
+        return await asyncio.shield(fut)
+
+    async def _ejecutar(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        for intento in range(self.reintentos + 1):
+            await self._entrar()
+            try:
+                return await loop.run_in_executor(self._hilos, partial(fn, *args))
+            except Exception as e:
+                if not es_limite_cuota(e) or intento == self.reintentos:
+                    raise
+                self.reintentadas += 1
+            finally:
+                self._salir()
+            # fuera del turno: mientras esperamos, otra petición puede usarlo
+            await asyncio.sleep(self.backoff * (2 ** intento) * (0.5 + random.random()))
+        raise AssertionError('inalcanzable')
+
+    async def _entrar(self):
+        t0 = time.perf_counter()
+        self.esperando += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.espera_max)
+        except asyncio.TimeoutError:
+            self.rechazadas += 1
+            raise GeminiSaturado('Demasiadas consultas a Gemini en cola') from None
+        finally:
+            self.esperando -= 1
+            self._esperas.append(time.perf_counter() - t0)
+        self.activas += 1
+        self.llamadas += 1
+
+    def _salir(self):
+        self.activas -= 1
+        self._sem.release()
+
+    def cerrar(self):
+        self._hilos.shutdown(wait=False, cancel_futures=True)
+
+    def metricas(self) -> dict:
+        def pct(p):
+            if not self._esperas:
+                return None
+            v = sorted(self._esperas)
+            return round(v[min(len(v) - 1, int(p * len(v)))] * 1000)
+        return {
+            'max_concurrencia': self.max_concurrencia,
+            'en_cola': self.esperando,
+            'activas': self.activas,
+            'llamadas': self.llamadas,
+            'rechazadas': self.rechazadas,
+            'reintentadas': self.reintentadas,
+            'coalescidas': self.coalescidas,
+            'espera_ms_p50': pct(0.5),
+            'espera_ms_p95': pct(0.95),
+        }
@@ -0,0 +1,117 @@
+"""
+Exportación del inventario en streaming (CSV y, si está pyarrow, Parquet).
+
+Las filas salen de un cursor de asyncpg sobre una sentencia preparada y se
+escriben por tandas: la memoria no crece con el tamaño del inventario y la
+descarga empieza con la primera tanda.
+"""
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+TANDA = 500  # filas por trozo enviado
+
+
+def _celda(v):
+    if v is None:
+        return ''
+    if isinstance(v, datetime):
+        return v.isoformat(sep=' ', timespec='seconds')
+    if isinstance(v, (list, tuple)):
+        return ','.join(str(x) for x in v)
+    return v
+
+
+async def csv_stream(stmt, params: list):
+    """Trozos de CSV (bytes, UTF-8) a partir de una sentencia preparada.
+
+    Hay que iterarlo dentro de una transacción (requisito de los cursores de asyncpg).
+    """
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow([a.name for a in stmt.get_attributes()])
+    n = 0
+    async for r in stmt.cursor(*params, prefetch=TANDA):
+        w.writerow([_celda(v) for v in r.values()])
+        n += 1
+        if n % TANDA == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+# tipo de Postgres -> (tipo de Arrow, conversión del valor)
+def _arrow_tipo(pg: str):
+    if pg in ('int2', 'int4', 'int8'):
+        return pa.int64(), None
+    if pg in ('numeric', 'float4', 'float8'):
+        return pa.float64(), lambda v: float(v) if isinstance(v, Decimal) else v
+    if pg == 'bool':
+        return pa.bool_(), None
+    if pg == 'timestamp':
+        return pa.timestamp('us'), None
+    if pg == 'timestamptz':
+        return pa.timestamp('us', tz='UTC'), None
+    if pg == 'date':
+        return pa.date32(), None
+    return pa.string(), lambda v: _celda(v) if not isinstance(v, str) else v
+
+
+class _Sumidero(io.RawIOBase):
+    """Fichero de solo escritura que acumula lo escrito hasta que se recoge."""
+
+    def __init__(self):
+        self._trozos: list[bytes] = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._trozos.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def recoger(self) -> bytes:
+        out = b''.join(self._trozos)
+        self._trozos.clear()
+        return out
+
+
+async def parquet_stream(stmt, params: list):
+    """Trozos de un Parquet (un row group por tanda). Mismas condiciones que csv_stream."""
+    attrs = stmt.get_attributes()
+    tipos = [_arrow_tipo(a.type.name) for a in attrs]
+    schema = pa.schema([(a.name, t) for a, (t, _) in zip(attrs, tipos)])
+    sink = _Sumidero()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+
+    def escribir(filas):
+        cols = [[conv(v) if conv and v is not None else v for v in col]
+                for col, (_, conv) in zip(zip(*filas), tipos)]
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(c, type=t) for c, (t, _) in zip(cols, tipos)], schema=schema))
+
+    filas = []
+    try:
+        async for r in stmt.cursor(*params, prefetch=TANDA):
+            filas.append(tuple(r.values()))
+            if len(filas) == TANDA:
+                escribir(filas); filas.clear()
+                yield sink.recoger()
+        if filas:
+            escribir(filas)
+    finally:
+        writer.close()
+    yield sink.recoger()
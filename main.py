@@ -1,20 +1,21 @@
 # main.py — Inventario El Jueves (NiceGUI + asyncpg)
 # Fixes: desactiva y limpia Service Worker para evitar recargas, ancla miniaturas, botones admin operativos (diálogos completos + 'Vendido' = eliminar)
 
-from nicegui import ui, app
+from nicegui import ui, app, run
 from fastapi import Response, Request, status
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse, RedirectResponse, JSONResponse
+from starlette.responses import FileResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncpg
-import os, base64, urllib.parse, urllib.request, hashlib, hmac, asyncio, html, math
+import os, base64, urllib.parse, hashlib, hmac, asyncio, html, math
 from functools import partial
 from dotenv import load_dotenv
-import pandas as pd
 from datetime import datetime
 from PIL import Image, features
 from io import BytesIO
-import json
+import json, time
+from email.utils import formatdate, parsedate_to_datetime
+from decimal import Decimal, InvalidOperation
 
 load_dotenv()
 PAGE_SIZE = 30
@@ -32,6 +33,12 @@ except ImportError:
 
 from asesor_estilo import StyleAdvisor, advisor_chat_ui
 from ios_installer import show_ios_install_banner
+from cache_ttl import TTLCache
+import busqueda
+import variantes
+from descargas import Descargador
+from ejecutor_gemini import EjecutorGemini
+import exportar
 
 # ---------- helpers ----------
 def _esc(s: str) -> str:
@@ -759,6 +766,30 @@ def _r2_key_from_url(url: str | None) -> str | None:
         return None
     return url[len(R2_PUBLIC_URL):].lstrip('/')
 
+# Todas las lecturas HTTP salientes pasan por aquí (keep-alive, reintentos, tope de concurrencia)
+DESCARGAS = Descargador(
+    max_concurrencia=int(os.getenv('HTTP_MAX_CONCURRENCY', '8')),
+    timeout=float(os.getenv('HTTP_TIMEOUT', '10')),
+)
+
+# Llamadas a Gemini (análisis de fotos y asesor): hilos propios, tope y reintentos en 429
+GEMINI = EjecutorGemini(
+    max_concurrencia=int(os.getenv('GEMINI_MAX_CONCURRENCY', '4')),
+    espera_max=float(os.getenv('GEMINI_QUEUE_TIMEOUT', '20')),
+)
+
+def _r2_keys_imagen(url: str | None, anchos=(), og_url: str | None = None) -> list[str]:
+    """Claves de R2 de una imagen: principal, variantes de tamaño y JPEG de Open Graph."""
+    urls = [url] + ([variantes.url(url, w) for w in anchos] if url else []) + [og_url]
+    return [k for k in (_r2_key_from_url(u) for u in urls) if k]
+
+async def _r2_delete_keys(keys):
+    """Borra claves de R2 en paralelo en hilos (boto3 bloquea), con el mismo tope que las subidas."""
+    async def borrar(key):
+        async with _UPLOAD_SEM:
+            await run.io_bound(_r2_delete, key)
+    await asyncio.gather(*(borrar(k) for k in keys))
+
 @app.on_startup
 async def startup():
     app.state.pool = await asyncpg.create_pool(dsn=DB_DSN, min_size=1, max_size=5)
@@ -766,10 +797,18 @@ async def startup():
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_muebles_vendido_tienda ON muebles (vendido, tienda)")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_muebles_tipo ON muebles (tipo)")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_muebles_lower_nombre ON muebles (LOWER(nombre))")
-    app.state.advisor = StyleAdvisor(os.getenv('GEMINI_API_KEY', '').strip(), app.state.pool)
+        await conn.execute("ALTER TABLE imagenes_muebles ADD COLUMN IF NOT EXISTS variantes INT[]")
+        await conn.execute("ALTER TABLE imagenes_muebles ADD COLUMN IF NOT EXISTS og_url TEXT")
+        await conn.execute("ALTER TABLE muebles ADD COLUMN IF NOT EXISTS fecha_vendido TIMESTAMPTZ")
+        await busqueda.preparar(conn)
+    await _refrescar_tipos_bg()
+    app.state.advisor = StyleAdvisor(os.getenv('GEMINI_API_KEY', '').strip(), app.state.pool,
+                                     ejecutor=GEMINI)
 
 @app.on_shutdown
 async def shutdown():
+    await DESCARGAS.cerrar()
+    GEMINI.cerrar()
     await app.state.pool.close()
 
 # ---------- Auth ----------
@@ -803,11 +842,14 @@ async def analyze_image_with_gemini(image_bytes: bytes) -> dict:
         "}\n"
         "Solo el JSON puro, sin texto adicional, sin backticks, sin markdown."
     )
-    try:
+    def generar():
         img = Image.open(BytesIO(image_bytes))
         img.thumbnail((1024, 1024))
         model = genai.GenerativeModel('gemini-2.5-flash')
-        resp = await asyncio.to_thread(model.generate_content, [prompt, img])
+        return model.generate_content([prompt, img])
+    try:
+        # misma foto subida dos veces a la vez -> una sola llamada
+        resp = await GEMINI.ejecutar(generar, clave=('foto', hashlib.sha256(image_bytes).hexdigest()))
         text = (resp.text or '').strip()
         if text.startswith('```'):
             text = text.strip('`').strip()
@@ -858,7 +900,7 @@ def _to_float_or_none(v):
 
 from PIL import Image, features  # ya importado arriba
 
-def _encode_image_to_webp_or_jpeg(im: Image.Image, max_size=800, quality=85) -> tuple[bytes, str]:
+def _encode_image_to_webp_or_jpeg(im: Image.Image, max_size=800, quality=85, method=6) -> tuple[bytes, str]:
     """Devuelve (bytes, mime) en WEBP si hay soporte; si no, en JPEG."""
     if im.mode not in ('RGB', 'RGBA'):
         im = im.convert('RGB')
@@ -867,7 +909,7 @@ def _encode_image_to_webp_or_jpeg(im: Image.Image, max_size=800, quality=85) ->
     buf = BytesIO()
 
     if features.check('webp'):
-        im.save(buf, format='WEBP', quality=quality, method=6)
+        im.save(buf, format='WEBP', quality=quality, method=method)
         return buf.getvalue(), 'image/webp'
     else:
         im = im.convert('RGB')
@@ -880,6 +922,17 @@ def to_img_bytes(raw: bytes, max_size=800, quality=85) -> bytes:
     data, _mime = _encode_image_to_webp_or_jpeg(im, max_size=max_size, quality=quality)
     return data
 
+def _encode_variants(raw: bytes) -> dict:
+    """Todo lo que se sube por imagen: {'main': (bytes, mime), ancho: (bytes, mime), 'og': (jpeg, mime)}."""
+    im = Image.open(BytesIO(raw))
+    im.load()
+    out = {'main': _encode_image_to_webp_or_jpeg(im, max_size=800, quality=85)}
+    for w in variantes.ANCHOS:
+        # method=4: 5 codificaciones por foto, la 6 no compensa en tamaños pequeños
+        out[w] = _encode_image_to_webp_or_jpeg(im, max_size=w, quality=82, method=4)
+    out['og'] = (_jpeg_from_bytes(raw), 'image/jpeg')
+    return out
+
 def _thumb_bytes(src: bytes, px=720) -> tuple[bytes, str]:
     """Thumbnail: devuelve (bytes, mime) en WEBP o JPEG."""
     im = Image.open(BytesIO(src))
@@ -960,12 +1013,34 @@ def _fmt_fecha(dt):
     d = _parse_dt(dt)
     return d.strftime("%d/%m/%Y %H:%M") if d else (str(dt) if dt else "")
 
+# ---------- Caché de URLs de imagen ----------
+# (mueble_id, i) -> (imagen_url, anchos)  y  img_id -> (imagen_url, anchos). Evita una consulta por miniatura.
+IMG_URL_CACHE = TTLCache(maxsize=4096, ttl=600)
+THUMB_PX = 360  # ?thumb=1 sirve la variante más pequeña que cubra esto
+
+def _redirect_img(cached: tuple, thumb: int):
+    url, anchos = cached
+    if thumb:
+        url = variantes.mejor(url, anchos, THUMB_PX)
+    return RedirectResponse(url, status_code=307)
+
+def _invalidar_imagenes(mueble_id: int | None = None, img_ids=()):
+    """Olvida las URLs cacheadas de un mueble (todas sus posiciones) y de los img_id dados."""
+    if mueble_id is not None:
+        IMG_URL_CACHE.invalidate_where(lambda k: k[0] == 'mid' and k[1] == mueble_id)
+        OG_URL_CACHE.pop(mueble_id)  # la principal puede haber cambiado
+    for iid in img_ids:
+        IMG_URL_CACHE.pop(('id', int(iid)))
+
 @app.get('/img/{mueble_id}')
 async def img(request: Request, mueble_id: int, i: int = 0, thumb: int = 0):
+    cached = IMG_URL_CACHE.get(('mid', mueble_id, i))
+    if cached:
+        return _redirect_img(cached, thumb)
     try:
         async with app.state.pool.acquire() as conn:
             row = await conn.fetchrow("""
-                SELECT imagen_url FROM imagenes_muebles
+                SELECT imagen_url, variantes FROM imagenes_muebles
                 WHERE mueble_id=$1
                 ORDER BY es_principal DESC, id ASC
                 OFFSET $2 LIMIT 1
@@ -976,7 +1051,9 @@ async def img(request: Request, mueble_id: int, i: int = 0, thumb: int = 0):
             return Response(status_code=404)
 
         if row['imagen_url']:
-            return RedirectResponse(row['imagen_url'], status_code=307)
+            cached = (row['imagen_url'], variantes.parse(row['variantes']))
+            IMG_URL_CACHE.set(('mid', mueble_id, i), cached)
+            return _redirect_img(cached, thumb)
 
         return Response(status_code=404)
 
@@ -987,15 +1064,20 @@ async def img(request: Request, mueble_id: int, i: int = 0, thumb: int = 0):
 
 @app.get('/img_by_id/{img_id}')
 async def img_by_id(request: Request, img_id: int, thumb: int = 0):
+    cached = IMG_URL_CACHE.get(('id', img_id))
+    if cached:
+        return _redirect_img(cached, thumb)
     async with app.state.pool.acquire() as conn:
         row = await conn.fetchrow(
-            'SELECT imagen_url FROM imagenes_muebles WHERE id=$1', img_id
+            'SELECT imagen_url, variantes FROM imagenes_muebles WHERE id=$1', img_id
         )
     if not row:
         return Response(status_code=404)
 
     if row['imagen_url']:
-        return RedirectResponse(row['imagen_url'], status_code=307)
+        cached = (row['imagen_url'], variantes.parse(row['variantes']))
+        IMG_URL_CACHE.set(('id', img_id), cached)
+        return _redirect_img(cached, thumb)
 
     return Response(status_code=404)
 
@@ -1024,33 +1106,61 @@ def _jpeg_from_bytes(raw: bytes, max_w: int = 1200, quality: int = 86) -> bytes:
     im.save(buf, format='JPEG', quality=quality, optimize=True, progressive=True)
     return buf.getvalue()
 
-@app.get('/og_img/{mueble_id}.jpg')
-async def og_img(request: Request, mueble_id: int):
+# mueble_id -> URL en R2 del JPEG OG de su imagen principal (se genera una sola vez)
+OG_URL_CACHE = TTLCache(maxsize=2048, ttl=3600)
+_og_en_curso: dict[int, asyncio.Task] = {}
+
+async def _generar_og(mueble_id: int) -> tuple[str | None, bytes | None]:
+    """(url_og, None) si queda guardado en R2; (None, jpeg) si solo se pudo generar al vuelo."""
     async with app.state.pool.acquire() as conn:
         row = await conn.fetchrow("""
-            SELECT imagen_url FROM imagenes_muebles
+            SELECT id, imagen_url, og_url FROM imagenes_muebles
             WHERE mueble_id=$1
             ORDER BY es_principal DESC, id ASC
             LIMIT 1
         """, mueble_id)
-    if not row:
-        return Response(status_code=404)
+    if not row or not row['imagen_url']:
+        return None, None
+    if row['og_url']:
+        return row['og_url'], None
+    # Imágenes anteriores a las variantes: se genera ahora y se guarda para los siguientes
+    src = await DESCARGAS.get_bytes(row['imagen_url'])
+    jpeg = await run.cpu_bound(_jpeg_from_bytes, src)
+    og_url = variantes.url(row['imagen_url'], 'og')
+    key = _r2_key_from_url(og_url)
+    if not key:
+        return None, jpeg
     try:
-        if row['imagen_url']:
-            req = urllib.request.Request(
-                row['imagen_url'],
-                headers={'User-Agent': 'inventario-el-jueves/1.0'},
-            )
-            with urllib.request.urlopen(req, timeout=10) as r:
-                src = r.read()
-            jpeg = _jpeg_from_bytes(src)
-        else:
-            return Response(status_code=404)
+        await run.io_bound(_r2_put, key, jpeg, 'image/jpeg')
     except Exception as e:
-        print(f"[og_img] ERROR mid={mueble_id}: {type(e).__name__}: {e}")
-        return Response(status_code=500)
-    headers = {'Cache-Control': 'public, max-age=2592000', 'Content-Type': 'image/jpeg'}
-    return Response(content=jpeg, media_type='image/jpeg', headers=headers)
+        print(f"[og_img] no se pudo guardar en R2 mid={mueble_id}: {e}")
+        return None, jpeg
+    await app.state.pool.execute('UPDATE imagenes_muebles SET og_url=$1 WHERE id=$2', og_url, row['id'])
+    return og_url, None
+
+@app.get('/og_img/{mueble_id}.jpg')
+async def og_img(request: Request, mueble_id: int):
+    og_url = OG_URL_CACHE.get(mueble_id)
+    if not og_url:
+        # varios crawlers a la vez sobre el mismo mueble comparten una sola generación
+        task = _og_en_curso.get(mueble_id)
+        if task is None:
+            task = asyncio.ensure_future(_generar_og(mueble_id))
+            _og_en_curso[mueble_id] = task
+            task.add_done_callback(lambda _t, _mid=mueble_id: _og_en_curso.pop(_mid, None))
+        try:
+            og_url, jpeg = await asyncio.shield(task)
+        except Exception as e:
+            print(f"[og_img] ERROR mid={mueble_id}: {type(e).__name__}: {e}")
+            return Response(status_code=500)
+        if not og_url:
+            if jpeg is None:
+                return Response(status_code=404)
+            headers = {'Cache-Control': 'public, max-age=2592000', 'Content-Type': 'image/jpeg'}
+            return Response(content=jpeg, media_type='image/jpeg', headers=headers)
+        OG_URL_CACHE.set(mueble_id, og_url)
+    # la principal puede cambiar: el redirect se cachea poco; el JPEG de R2 es inmutable
+    return RedirectResponse(og_url, status_code=307, headers={'Cache-Control': 'public, max-age=3600'})
 
 # === Service Worker en raíz ===
 @app.get('/service-worker.js', include_in_schema=False)
@@ -1083,27 +1193,34 @@ async def health():
     try:
         async with app.state.pool.acquire() as conn:
             await conn.execute('SELECT 1')
-        return JSONResponse({'status': 'ok', 'db': 'ok'})
+        return JSONResponse({'status': 'ok', 'db': 'ok',
+                             'cache': {'img_url': IMG_URL_CACHE.stats(),
+                                       'og_img': OG_URL_CACHE.stats(),
+                                       'og_page': OG_PAGE_CACHE.stats(),
+                                       'api': API_CACHE.stats(),
+                                       'stats': STATS_CACHE.stats()},
+                             'asesor': app.state.advisor.metricas(),
+                             'gemini': GEMINI.metricas()})
     except Exception:
         return JSONResponse({'status': 'error', 'db': 'error'}, status_code=503)
 
 # === Página SSR con OG: /o/{id} ===
+# HTML por (mid, versión de fila, origen). La versión sube en cada update/delete, así que un
+# render que estuviera en curso durante una escritura nunca se sirve. Se guarda partido en
+# (antes, después) de og:url, que lleva la URL de cada petición (con su ?v= anti-caché).
+OG_PAGE_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_og_page_version: dict[int, int] = {}
+
+def _invalidar_og_page(mid: int):
+    _og_page_version[mid] = _og_page_version.get(mid, 0) + 1
+    OG_PAGE_CACHE.invalidate_where(lambda k: k[0] == mid)
+
 @app.get('/o/{mid}')
 async def og_page(request: Request, mid: int):
-    async with app.state.pool.acquire() as conn:
-        m = await conn.fetchrow('SELECT * FROM muebles WHERE id=$1', mid)
-    if not m:
-        return Response('Not found', status_code=status.HTTP_404_NOT_FOUND, media_type='text/plain')
-
     origin = _origin_from(request)  # <- usa el mismo host de la petición
-    title = f"{m['nombre']} · {_fmt_precio(m.get('precio'))}"
-    desc = (m.get('descripcion') or '').strip()
-    if len(desc) > 200: desc = desc[:200] + '…'
-
-    img_url = f"{origin}/og_img/{mid}.jpg"
     human_url = f"{origin}/?id={mid}"
-    full_url = str(request.url)
 
+    # Personas: redirección directa, sin tocar la BD
     ua = (request.headers.get('user-agent') or '').lower()
     is_bot = any(k in ua for k in (
         'whatsapp','facebookexternalhit','twitterbot','telegram','discordbot','slackbot','linkedinbot'
@@ -1111,7 +1228,28 @@ async def og_page(request: Request, mid: int):
     if not is_bot:
         return RedirectResponse(url=human_url, status_code=302)
 
-    html_doc = f"""<!doctype html>
+    key = (mid, _og_page_version.get(mid, 0), origin)
+    partes = OG_PAGE_CACHE.get(key)
+    if partes is None:
+        async with app.state.pool.acquire() as conn:
+            m = await conn.fetchrow('SELECT nombre, precio, descripcion FROM muebles WHERE id=$1', mid)
+        partes = _og_page_html(m, mid, origin, human_url).split(_OG_URL_HUECO) if m else False
+        OG_PAGE_CACHE.set(key, partes, ttl=None if m else 60)
+    if partes is False:
+        return Response('Not found', status_code=status.HTTP_404_NOT_FOUND, media_type='text/plain')
+    antes, despues = partes
+    return Response(antes + _esc(str(request.url)) + despues, media_type='text/html; charset=utf-8')
+
+_OG_URL_HUECO = '\x00og:url\x00'  # Postgres no admite NUL en text: no choca con nombre/descripción
+
+def _og_page_html(m, mid: int, origin: str, human_url: str) -> str:
+    title = f"{m['nombre']} · {_fmt_precio(m.get('precio'))}"
+    desc = (m.get('descripcion') or '').strip()
+    if len(desc) > 200: desc = desc[:200] + '…'
+
+    img_url = f"{origin}/og_img/{mid}.jpg"
+
+    return f"""<!doctype html>
 <html lang="es">
 <head>
 <meta charset="utf-8">
@@ -1130,7 +1268,7 @@ async def og_page(request: Request, mid: int):
 <meta property="og:image" content="{img_url}">
 <meta property="og:image:secure_url" content="{img_url}">
 <meta property="og:image:type" content="image/jpeg">
-<meta property="og:url" content="{_esc(full_url)}">
+<meta property="og:url" content="{_OG_URL_HUECO}">
 <meta property="og:type" content="website">
 <meta property="og:site_name" content="Inventario de Antigüedades El Jueves">
 
@@ -1143,34 +1281,216 @@ async def og_page(request: Request, mid: int):
 <p>Vista previa para compartir <a href="{human_url}">{_esc(title)}</a>.</p>
 </body>
 </html>"""
-    return Response(html_doc, media_type='text/html; charset=utf-8')
+
+# ---------- Tipos en memoria ----------
+# tipo -> {'total': n, 'disponibles': n}. Se rellena al arrancar y se rehace en segundo
+# plano tras cada escritura que cambie tipos o vendidos; las páginas no esperan a la BD.
+_TIPOS_CONTEOS: dict[str, dict] | None = None
+_tipos_version = 0          # sube con cada escritura
+_tipos_tarea: asyncio.Task | None = None
+
+async def _cargar_tipos():
+    global _TIPOS_CONTEOS, _api_version
+    while True:
+        version = _tipos_version
+        async with app.state.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT tipo, COUNT(*) AS total, COUNT(*) FILTER (WHERE NOT vendido) AS disponibles
+                FROM muebles WHERE tipo IS NOT NULL AND tipo <> ''
+                GROUP BY tipo
+                """
+            )
+        _TIPOS_CONTEOS = {r['tipo']: {'total': r['total'], 'disponibles': r['disponibles']} for r in rows}
+        API_CACHE.pop(('categorias',))
+        _api_version += 1
+        if version == _tipos_version:  # nadie escribió mientras consultábamos
+            return
+
+async def _refrescar_tipos_bg():
+    try:
+        await _cargar_tipos()
+    except Exception as e:
+        print(f"[tipos] no se pudieron recargar: {type(e).__name__}: {e}")
+
+def _invalidar_tipos():
+    """Tras escribir tipo/vendido: recarga los conteos sin bloquear a quien escribe."""
+    global _tipos_version, _tipos_tarea
+    _tipos_version += 1
+    if _tipos_tarea is None or _tipos_tarea.done():
+        _tipos_tarea = asyncio.create_task(_refrescar_tipos_bg())
+    # si ya hay una en marcha, verá la versión nueva y repetirá la consulta
+
+async def conteos_tipos() -> dict[str, dict]:
+    if _TIPOS_CONTEOS is None:
+        await _cargar_tipos()
+    return _TIPOS_CONTEOS
+
+def _lista_tipos(conteos: dict) -> list[str]:
+    return sorted(set(conteos) | set(TIPOS))
+
+# ---------- Estadísticas (panel admin) ----------
+# Una sola agregación agrupada; el resultado vive en caché hasta la siguiente escritura.
+STATS_CACHE = TTLCache(maxsize=1, ttl=600)
+
+def _invalidar_stats():
+    STATS_CACHE.clear()
+
+async def query_stats() -> dict:
+    st = STATS_CACHE.get('stats')
+    if st is not None:
+        return st
+    async with app.state.pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT tienda, tipo, vendido, COUNT(*) AS n, COALESCE(SUM(precio), 0) AS valor,
+                   SUM(EXTRACT(EPOCH FROM fecha_vendido - fecha) / 86400)
+                       FILTER (WHERE vendido AND fecha_vendido IS NOT NULL) AS dias,
+                   COUNT(*) FILTER (WHERE vendido AND fecha_vendido IS NOT NULL) AS n_dias
+            FROM muebles
+            GROUP BY tienda, tipo, vendido
+            """
+        )
+    por_tienda: dict[str, dict] = {}
+    por_tipo: dict[str, dict] = {}
+    vendidos, dias, n_dias = 0, 0.0, 0
+    for r in rows:
+        if r['vendido']:
+            vendidos += r['n']
+            dias += float(r['dias'] or 0); n_dias += r['n_dias']
+        else:
+            t = por_tienda.setdefault(r['tienda'] or '—', {'disponibles': 0, 'valor': 0.0})
+            t['disponibles'] += r['n']; t['valor'] += float(r['valor'])
+        c = por_tipo.setdefault(r['tipo'] or '—', {'disponibles': 0, 'vendidos': 0})
+        c['vendidos' if r['vendido'] else 'disponibles'] += r['n']
+    st = {
+        'por_tienda': por_tienda,
+        'por_tipo': dict(sorted(por_tipo.items())),
+        'vendidos': vendidos,
+        'dias_venta': round(dias / n_dias, 1) if n_dias else None,  # solo ventas con fecha registrada
+    }
+    STATS_CACHE.set('stats', st)
+    return st
+
+def _invalidar_asesor(retirado: int | None = None):
+    """`retirado`: pieza vendida o borrada (el asesor olvida las respuestas que la citan)."""
+    advisor = getattr(app.state, 'advisor', None)
+    if advisor is not None:
+        advisor.invalidar_inventario([retirado] if retirado is not None else ())
 
 # ---------- DB helpers ----------
 async def query_tipos():
-    async with app.state.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT DISTINCT tipo FROM muebles ORDER BY tipo")
-    existentes = [r['tipo'] for r in rows if r['tipo']]
-    return ['Todos'] + sorted(set(existentes + TIPOS))
+    return ['Todos'] + _lista_tipos(await conteos_tipos())
+
+# ---------- Paginación por cursor (keyset) ----------
+# orden -> (columna, dirección). Empates en precio/relevancia se deshacen por id en la misma dirección.
+ORDENES = {
+    'Más reciente': ('id', 'DESC'),
+    'Más antiguo':  ('id', 'ASC'),
+    'Precio ↑':     ('precio', 'ASC'),
+    'Precio ↓':     ('precio', 'DESC'),
+    'Relevancia':   ('rank', 'DESC'),
+}
 
-async def query_muebles(vendidos:bool|None, tienda:str|None, tipo:str|None,
-                        nombre_like:str|None, orden:str, limit:int|None=None, offset:int|None=None,
-                        precio_min:float|None=None, precio_max:float|None=None):
-    where, params = [], []
+def _order_sql(orden: str, alias: str = '') -> str:
+    col, d = ORDENES.get(orden, ORDENES['Más reciente'])
+    if col == 'id':
+        return f'{alias}id {d}'
+    if col == 'rank':
+        return f'rank {d}, {alias}id {d}'
+    return f'{alias}precio {d} NULLS LAST, {alias}id {d}'
+
+def _encode_cursor(orden: str, row) -> str:
+    """Cursor opaco con la clave de ordenación de la última fila servida."""
+    orden = orden if orden in ORDENES else 'Más reciente'
+    payload = {'o': orden, 'id': int(row['id'])}
+    if ORDENES[orden][0] == 'precio':
+        payload['p'] = None if row['precio'] is None else str(row['precio'])
+    elif ORDENES[orden][0] == 'rank':
+        payload['r'] = float(row['rank'])
+    raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor: str, orden: str) -> dict:
+    """Lanza ValueError si el cursor está corrupto o es de otro orden."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        data['id'] = int(data['id'])
+        if data.get('p') is not None:
+            data['p'] = Decimal(str(data['p']))
+        if data.get('r') is not None:
+            data['r'] = float(data['r'])
+    except (ValueError, TypeError, KeyError, InvalidOperation) as e:
+        raise ValueError(f'cursor no válido: {e}') from None
+    if data.get('o') != (orden if orden in ORDENES else 'Más reciente'):
+        raise ValueError('cursor de otro orden')
+    return data
+
+def _keyset_where(orden: str, cur: dict, params: list, alias: str = '',
+                  rank_sql: str = '0::real') -> str:
+    """Condición 'después del cursor' para el orden dado (incluye precio NULLS LAST)."""
+    col, d = ORDENES.get(orden, ORDENES['Más reciente'])
+    op = '<' if d == 'DESC' else '>'
+    params.append(cur['id']); pid = f'${len(params)}'
+    if col == 'id':
+        return f'{alias}id {op} {pid}'
+    if col == 'rank':
+        # misma expresión que la columna `rank` de la SELECT: resultado real idéntico
+        params.append(cur.get('r') or 0.0); pr = f'${len(params)}::real'
+        return f'({rank_sql} {op} {pr} OR ({rank_sql} = {pr} AND {alias}id {op} {pid}))'
+    if cur.get('p') is None:
+        # ya estamos en la cola de precios NULL: solo avanza el id
+        return f'({alias}precio IS NULL AND {alias}id {op} {pid})'
+    params.append(cur['p']); pp = f'${len(params)}'
+    return (f'({alias}precio {op} {pp} OR ({alias}precio = {pp} AND {alias}id {op} {pid}) '
+            f'OR {alias}precio IS NULL)')
+
+def _where_muebles(params: list, vendidos:bool|None, tienda:str|None, tipo:str|None,
+                   nombre_like:str|None, precio_min:float|None=None, precio_max:float|None=None) -> list[str]:
+    """Condiciones de los filtros del listado (compartidas con la exportación)."""
+    where = []
     if vendidos is not None:
         where.append(f'vendido = ${len(params)+1}'); params.append(vendidos)
     if tienda and tienda!='Todas':
         where.append(f'tienda = ${len(params)+1}'); params.append(tienda)
     if tipo and tipo != 'Todos':
         where.append(f'tipo = ${len(params)+1}'); params.append(tipo)
-    if nombre_like:
-        where.append(f'LOWER(nombre) LIKE ${len(params)+1}'); params.append(f'%{nombre_like.lower()}%')
+    if nombre_like and nombre_like.strip():
+        where.append(busqueda.condicion(nombre_like, params))
     if precio_min is not None:
         where.append(f'precio >= ${len(params)+1}'); params.append(precio_min)
     if precio_max is not None:
         where.append(f'precio <= ${len(params)+1}'); params.append(precio_max)
-    order_sql = {'Más reciente':'id DESC','Más antiguo':'id ASC','Precio ↑':'precio ASC NULLS LAST','Precio ↓':'precio DESC NULLS LAST'}.get(orden,'id DESC')
+    return where
+
+async def query_muebles(vendidos:bool|None, tienda:str|None, tipo:str|None,
+                        nombre_like:str|None, orden:str, limit:int|None=None, offset:int|None=None,
+                        precio_min:float|None=None, precio_max:float|None=None,
+                        after:str|None=None):
+    params = []
+    where = _where_muebles(params, vendidos, tienda, tipo, nombre_like, precio_min, precio_max)
+    rank_sql = busqueda.ranking(nombre_like, params) if ORDENES.get(orden, ('',))[0] == 'rank' else None
+    if after:
+        where.append(_keyset_where(orden, _decode_cursor(after, orden), params,
+                                   rank_sql=rank_sql or '0::real'))
+    order_sql = _order_sql(orden)
     where_sql = ' AND '.join(where) if where else 'TRUE'
-    sql = f"SELECT * FROM muebles WHERE {where_sql} ORDER BY {order_sql}"
+    # URLs de R2 ordenadas (principal primero) en la misma consulta: las cards no pasan por /img
+    sql = f"""
+        SELECT m.*,
+               COALESCE(img.imagenes, '{{}}') AS imagenes,
+               COALESCE(img.imagenes_var, '{{}}') AS imagenes_var
+               {f', {rank_sql} AS rank' if rank_sql else ''}
+        FROM muebles m
+        LEFT JOIN LATERAL (
+            SELECT array_agg(i.imagen_url ORDER BY i.es_principal DESC, i.id ASC) AS imagenes,
+                   array_agg(COALESCE(array_to_string(i.variantes, ','), '')
+                             ORDER BY i.es_principal DESC, i.id ASC) AS imagenes_var
+            FROM imagenes_muebles i
+            WHERE i.mueble_id = m.id AND i.imagen_url IS NOT NULL
+        ) img ON TRUE
+        WHERE {where_sql} ORDER BY {order_sql}"""
     if limit is not None:
         sql += f" LIMIT ${len(params)+1}"; params.append(limit)
     if offset is not None:
@@ -1187,48 +1507,101 @@ async def get_mueble(mueble_id: int):
         )
     return m, imgs
 
-async def add_mueble(data: dict, images_bytes: list[bytes]) -> int:
+# ---------- Ingesta de imágenes (codificación y subida en paralelo, acotadas) ----------
+_ENCODE_SEM = asyncio.Semaphore(int(os.getenv('IMG_ENCODE_CONCURRENCY', '3')))
+_UPLOAD_SEM = asyncio.Semaphore(int(os.getenv('IMG_UPLOAD_CONCURRENCY', '4')))
+
+async def _ingest_images(mueble_id: int, images_bytes: list[bytes], first_principal: bool,
+                         on_progress=None) -> int:
+    """Sube `images_bytes` a un mueble. Devuelve cuántas quedaron guardadas.
+
+    Las filas se insertan primero y en orden (el id fija el orden de la galería y la
+    principal); después cada imagen se codifica y sube en paralelo. Si una falla se
+    borra su fila y se sigue con las demás. `on_progress(hechas, total)` puede ser async.
+    """
+    total = len(images_bytes)
+    if not total:
+        return 0
     async with app.state.pool.acquire() as conn:
         async with conn.transaction():
-            mid = await conn.fetchval(
-                """
-                INSERT INTO muebles (nombre, precio, descripcion, tienda, tipo, fecha,
-                    alto,largo,fondo,diametro,diametro_base,diametro_boca,alto_respaldo,alto_asiento,ancho,vendido)
-                VALUES ($1,$2,$3,$4,$5, NOW(),
-                        $6,$7,$8,$9,$10,$11,$12,$13,$14,$15)
-                RETURNING id
-                """,
-                data.get('nombre'), data.get('precio'), data.get('descripcion'),
-                data.get('tienda'), data.get('tipo'),
-                data.get('alto'), data.get('largo'), data.get('fondo'),
-                data.get('diametro'), data.get('diametro_base'), data.get('diametro_boca'),
-                data.get('alto_respaldo'), data.get('alto_asiento'), data.get('ancho'),
-                False,
+            img_ids = []
+            for i in range(total):
+                img_ids.append(await conn.fetchval(
+                    'INSERT INTO imagenes_muebles (mueble_id, es_principal) '
+                    'VALUES ($1, $2) RETURNING id',
+                    mueble_id, (first_principal and i == 0)
+                ))
+
+    hechas = 0
+    async def una(i: int, img_id: int, raw: bytes) -> bool:
+        nonlocal hechas
+        ok = False
+        url = f'{R2_PUBLIC_URL}/{mueble_id}_{img_id}.webp'
+        encoded = None
+        try:
+            async with _ENCODE_SEM:
+                encoded = await run.cpu_bound(_encode_variants, raw)
+            subir = [(_r2_key_from_url(url), *encoded['main'])]
+            subir += [(_r2_key_from_url(variantes.url(url, w)), *encoded[w]) for w in variantes.ANCHOS]
+            subir.append((_r2_key_from_url(variantes.url(url, 'og')), *encoded['og']))
+            async def put(key, data, mime):
+                async with _UPLOAD_SEM:
+                    await run.io_bound(_r2_put, key, data, mime)
+            await asyncio.gather(*(put(*x) for x in subir))
+            await app.state.pool.execute(
+                'UPDATE imagenes_muebles SET imagen_url=$1, variantes=$2, og_url=$3 WHERE id=$4',
+                url, list(variantes.ANCHOS), variantes.url(url, 'og'), img_id
             )
+            ok = True
+        except Exception as e:
+            await app.state.pool.execute('DELETE FROM imagenes_muebles WHERE id=$1', img_id)
+            print(f"[ingesta] imagen {i} fallo: {type(e).__name__}: {e} — fila {img_id} eliminada")
+            if encoded is not None:  # lo que llegara a subirse
+                await _r2_delete_keys(_r2_keys_imagen(url, variantes.ANCHOS, variantes.url(url, 'og')))
+        hechas += 1
+        if on_progress:
+            res = on_progress(hechas, total)
+            if asyncio.iscoroutine(res):
+                await res
+        return ok
+
+    subidas = sum(await asyncio.gather(*(una(i, iid, raw)
+                                          for i, (iid, raw) in enumerate(zip(img_ids, images_bytes)))))
+    if first_principal and subidas:
+        # si falló la primera, la principal pasa a la siguiente que sí entró
+        await app.state.pool.execute(
+            """
+            UPDATE imagenes_muebles SET es_principal = TRUE
+            WHERE id = (SELECT MIN(id) FROM imagenes_muebles WHERE mueble_id = $1)
+              AND NOT EXISTS (SELECT 1 FROM imagenes_muebles WHERE mueble_id = $1 AND es_principal)
+            """, mueble_id
+        )
+    _invalidar_imagenes(mueble_id)
+    _invalidar_api(mueble_id, listados=False)
+    return subidas
 
-            # Procesar imágenes con manejo de errores
-            for i, b in enumerate(images_bytes):
-                try:
-                    b_webp = to_img_bytes(b)
-                    img_id = await conn.fetchval(
-                        'INSERT INTO imagenes_muebles (mueble_id, es_principal) '
-                        'VALUES ($1, $2) RETURNING id',
-                        mid, (i == 0)
-                    )
-                    key = f'{mid}_{img_id}.webp'
-                    try:
-                        _r2_put(key, b_webp, 'image/webp')
-                    except Exception as r2err:
-                        await conn.execute('DELETE FROM imagenes_muebles WHERE id=$1', img_id)
-                        print(f"Error subiendo imagen {i} a R2: {r2err} — fila {img_id} eliminada")
-                        continue
-                    url = f'{R2_PUBLIC_URL}/{key}'
-                    await conn.execute(
-                        'UPDATE imagenes_muebles SET imagen_url=$1 WHERE id=$2', url, img_id
-                    )
-                except Exception as e:
-                    print(f"Error procesando imagen {i}: {str(e)}")
-                    continue
+async def add_mueble(data: dict, images_bytes: list[bytes], on_progress=None) -> int:
+    async with app.state.pool.acquire() as conn:
+        mid = await conn.fetchval(
+            """
+            INSERT INTO muebles (nombre, precio, descripcion, tienda, tipo, fecha,
+                alto,largo,fondo,diametro,diametro_base,diametro_boca,alto_respaldo,alto_asiento,ancho,vendido)
+            VALUES ($1,$2,$3,$4,$5, NOW(),
+                    $6,$7,$8,$9,$10,$11,$12,$13,$14,$15)
+            RETURNING id
+            """,
+            data.get('nombre'), data.get('precio'), data.get('descripcion'),
+            data.get('tienda'), data.get('tipo'),
+            data.get('alto'), data.get('largo'), data.get('fondo'),
+            data.get('diametro'), data.get('diametro_base'), data.get('diametro_boca'),
+            data.get('alto_respaldo'), data.get('alto_asiento'), data.get('ancho'),
+            False,
+        )
+    await _ingest_images(mid, images_bytes, first_principal=True, on_progress=on_progress)
+    _invalidar_api(mid)  # por si había un 404 cacheado para ese id
+    _invalidar_tipos()
+    _invalidar_stats()
+    _invalidar_asesor()
     return mid
 
 
@@ -1239,61 +1612,67 @@ async def update_mueble(mueble_id: int, data: dict):
     for f in fields:
         if f in data:
             sets.append(f'{f}=${len(params)+1}'); params.append(data[f])
+            if f == 'vendido':
+                sets.append(_sql_fecha_vendido(f'${len(params)}'))
     if not sets:
         return
     params.append(mueble_id)
     sql = f'UPDATE muebles SET {", ".join(sets)} WHERE id=${len(params)}'
     async with app.state.pool.acquire() as conn:
         await conn.execute(sql, *params)
+    _invalidar_api(mueble_id, destacados='vendido' in data)
+    _invalidar_og_page(mueble_id)
+    if 'tipo' in data or 'vendido' in data:
+        _invalidar_tipos()
+    _invalidar_stats()
+    _invalidar_asesor(mueble_id if data.get('vendido') else None)
+
+def _sql_fecha_vendido(p: str) -> str:
+    # conserva la fecha de la primera venta; se borra si vuelve a estar disponible
+    return f'fecha_vendido = CASE WHEN {p}::boolean THEN COALESCE(fecha_vendido, NOW()) END'
 
 async def set_vendido(mueble_id: int, vendido: bool):
     async with app.state.pool.acquire() as conn:
-        await conn.execute('UPDATE muebles SET vendido=$1 WHERE id=$2', vendido, mueble_id)
+        await conn.execute(f'UPDATE muebles SET vendido=$1, {_sql_fecha_vendido("$1")} WHERE id=$2',
+                           vendido, mueble_id)
+    _invalidar_api(mueble_id, destacados=not vendido)
+    _invalidar_tipos()
+    _invalidar_stats()
+    _invalidar_asesor(mueble_id if vendido else None)
 
 async def delete_mueble(mueble_id: int):
     async with app.state.pool.acquire() as conn:
         urls = await conn.fetch(
-            'SELECT imagen_url FROM imagenes_muebles '
-            'WHERE mueble_id=$1 AND imagen_url IS NOT NULL',
+            'SELECT id, imagen_url, variantes, og_url FROM imagenes_muebles WHERE mueble_id=$1',
             mueble_id
         )
         async with conn.transaction():
             await conn.execute('DELETE FROM imagenes_muebles WHERE mueble_id=$1', mueble_id)
             await conn.execute('DELETE FROM muebles WHERE id=$1', mueble_id)
-    for r in urls:
-        key = _r2_key_from_url(r['imagen_url'])
-        if key:
-            _r2_delete(key)
+    _invalidar_imagenes(mueble_id, [r['id'] for r in urls])
+    _invalidar_api(mueble_id)
+    _invalidar_og_page(mueble_id)
+    _invalidar_tipos()
+    _invalidar_stats()
+    _invalidar_asesor(mueble_id)
+    await _r2_delete_keys([key for r in urls
+                           for key in _r2_keys_imagen(r['imagen_url'], variantes.parse(r['variantes']), r['og_url'])])
 
 async def add_image(mueble_id: int, content_bytes: bytes, will_be_principal: bool = False):
-    b_webp = to_img_bytes(content_bytes)
-    async with app.state.pool.acquire() as conn:
-        img_id = await conn.fetchval(
-            'INSERT INTO imagenes_muebles (mueble_id, es_principal) '
-            'VALUES ($1, $2) RETURNING id',
-            mueble_id, will_be_principal
-        )
-        key = f'{mueble_id}_{img_id}.webp'
-        try:
-            _r2_put(key, b_webp, 'image/webp')
-        except Exception as e:
-            await conn.execute('DELETE FROM imagenes_muebles WHERE id=$1', img_id)
-            print(f"[add_image] R2 upload fallo, fila {img_id} borrada: {e}")
-            raise
-        url = f'{R2_PUBLIC_URL}/{key}'
-        await conn.execute(
-            'UPDATE imagenes_muebles SET imagen_url=$1 WHERE id=$2', url, img_id
-        )
+    if not await _ingest_images(mueble_id, [content_bytes], first_principal=will_be_principal):
+        raise RuntimeError(f'no se pudo guardar la imagen del mueble {mueble_id}')
 
 async def delete_image(img_id: int):
     async with app.state.pool.acquire() as conn:
-        url = await conn.fetchval(
-            'SELECT imagen_url FROM imagenes_muebles WHERE id=$1', img_id
+        row = await conn.fetchrow(
+            'SELECT mueble_id, imagen_url, variantes, og_url FROM imagenes_muebles WHERE id=$1', img_id
         )
         await conn.execute('DELETE FROM imagenes_muebles WHERE id=$1', img_id)
-    key = _r2_key_from_url(url)
-    if key:
-        _r2_delete(key)
+    if not row:
+        return
+    _invalidar_imagenes(row['mueble_id'], [img_id])
+    _invalidar_api(row['mueble_id'], listados=False)
+    await _r2_delete_keys(_r2_keys_imagen(row['imagen_url'], variantes.parse(row['variantes']), row['og_url']))
 
 async def set_principal_image(mueble_id: int, img_id: int):
     async with app.state.pool.acquire() as conn:
@@ -1301,9 +1680,22 @@ async def set_principal_image(mueble_id: int, img_id: int):
             await conn.execute('UPDATE imagenes_muebles SET es_principal=FALSE WHERE mueble_id=$1', mueble_id)
             await conn.execute('UPDATE imagenes_muebles SET es_principal=TRUE WHERE id=$1 AND mueble_id=$2',
                                img_id, mueble_id)
+    _invalidar_imagenes(mueble_id)
+    _invalidar_api(mueble_id, listados=False)
 
 # ---------- Diálogos admin (completos, traídos del código antiguo) ----------
 
+def _barra_progreso_subida():
+    """Barra 'Subiendo imágenes n/total' (oculta) y su callback de progreso."""
+    with ui.column().classes('w-full gap-1 mt-3') as box:
+        texto = ui.label('').classes('text-caption')
+        barra = ui.linear_progress(value=0, show_value=False)
+    box.set_visibility(False)
+    def avance(hechas: int, total: int):
+        texto.set_text(f'Subiendo imágenes {hechas}/{total}…')
+        barra.set_value(hechas / total if total else 1)
+    return box, avance
+
 def dialog_add_mueble(on_saved=None):
     with ui.dialog() as d, ui.card().classes('w-[min(92vw,900px)] max-h-[92vh] overflow-auto p-4'):
         ui.label('Añadir nueva antigüedad').classes('text-xl font-bold')
@@ -1435,7 +1827,13 @@ def dialog_add_mueble(on_saved=None):
             print(f"[upload debug] files={len(new_bytes)} "
                   f"sizes={[len(b) for b in new_bytes] if new_bytes else []}")
 
-            await add_mueble(data, new_bytes)
+            btn_save.disable()
+            progreso.set_visibility(bool(new_bytes))
+            try:
+                await add_mueble(data, new_bytes, on_progress=avance_subida)
+            finally:
+                btn_save.enable()
+                progreso.set_visibility(False)
             ui.notify('¡Mueble añadido!', type='positive')
             d.close()
             if on_saved:
@@ -1458,6 +1856,8 @@ def dialog_add_mueble(on_saved=None):
             btn_next.set_visibility(n < 2)
             btn_save.set_visibility(n == 2)
 
+        progreso, avance_subida = _barra_progreso_subida()
+
         with ui.row().classes('justify-between items-center mt-4 w-full'):
             ui.button('Cancelar', on_click=d.close).props('flat')
             with ui.row().classes('gap-2'):
@@ -1471,11 +1871,12 @@ def dialog_add_mueble(on_saved=None):
     return d
 
 
-def dialog_edit_mueble(mueble_id: int, on_saved=None):
+def dialog_edit_mueble(on_saved=None):
+    """Diálogo de edición reutilizable: `cargar_datos(mueble_id)` lo rellena con esa pieza."""
     with ui.dialog() as d, ui.card().classes('w-[min(92vw,1000px)] max-h-[92vh] overflow-auto p-4'):
         ui.label('Editar mueble').classes('text-xl font-bold')
         cont = ui.column().classes('gap-3')
-        async def cargar_datos():
+        async def cargar_datos(mueble_id: int):
             mueble, _ = await get_mueble(mueble_id)
             cont.clear()
             with cont:
@@ -1505,7 +1906,8 @@ def dialog_edit_mueble(mueble_id: int, on_saved=None):
                 async def reload_imgs():
                     nonlocal imgs
                     imgs = await app.state.pool.fetch(
-                        'SELECT id, es_principal FROM imagenes_muebles WHERE mueble_id=$1 ORDER BY es_principal DESC, id ASC',
+                        'SELECT id, es_principal, imagen_url, variantes FROM imagenes_muebles '
+                        'WHERE mueble_id=$1 ORDER BY es_principal DESC, id ASC',
                         mueble_id
                     )
                     img_expansion.text = f'Imágenes ({len(imgs)})'
@@ -1514,7 +1916,9 @@ def dialog_edit_mueble(mueble_id: int, on_saved=None):
                         for img in imgs:
                             iid = int(img['id'])
                             with ui.column().classes('items-center'):
-                                ui.image(f'/img_by_id/{iid}?thumb=1') \
+                                src = (variantes.mejor(img['imagen_url'], variantes.parse(img['variantes']), 140)
+                                       if img['imagen_url'] else f'/img_by_id/{iid}?thumb=1')
+                                ui.image(src) \
                                     .props('onload="this.dataset.loaded=\'true\'"') \
                                     .classes('thumb-skeleton w-[140px] h-[140px] object-cover rounded')
                                 with ui.row().classes('gap-1'):
@@ -1547,6 +1951,7 @@ def dialog_edit_mueble(mueble_id: int, on_saved=None):
                     new_bytes.append(content)
                     ui.notify(f'Imagen subida ({len(new_bytes)})')
                 ui.upload(multiple=True, on_upload=on_upload)
+                progreso, avance_subida = _barra_progreso_subida()
                 with ui.row().classes('justify-end mt-3'):
                     ui.button('Cancelar', on_click=d.close).props('flat')
                     async def guardar(_=None):
@@ -1564,9 +1969,12 @@ def dialog_edit_mueble(mueble_id: int, on_saved=None):
                         }
                         await update_mueble(mueble_id, data)
                         if new_bytes:
-                            first_principal = (len(imgs) == 0)
-                            for i, raw in enumerate(new_bytes):
-                                await add_image(mueble_id, raw, will_be_principal=(first_principal and i == 0))
+                            progreso.set_visibility(True)
+                            try:
+                                await _ingest_images(mueble_id, new_bytes, first_principal=(len(imgs) == 0),
+                                                     on_progress=avance_subida)
+                            finally:
+                                progreso.set_visibility(False)
                         ui.notify('¡Cambios guardados!', type='positive')
                         d.close()
                         if on_saved:
@@ -1595,6 +2003,19 @@ def _kv_attr(label: str, value: str):
         f'</div>'
     )
 
+def _img_src(mid: int, imgs: list, i: int = 0, thumb: bool = False) -> str:
+    """URL directa de R2 si la tenemos; /img/... solo como último recurso."""
+    if i < len(imgs) and imgs[i]:
+        return imgs[i]
+    return f'/img/{mid}?i={i}&thumb=1&v={THUMB_VER}' if thumb else f'/img/{mid}?i={i}'
+
+def _srcset_props(imgs: list, anchos: list, i: int, sizes: str) -> str:
+    """Props srcset/sizes para ui.image (vacío si la imagen no tiene variantes)."""
+    if i >= len(imgs) or i >= len(anchos):
+        return ''
+    ss = variantes.srcset(imgs[i], variantes.parse(anchos[i]))
+    return f'srcset="{ss}" sizes="{sizes}"' if ss else ''
+
 def _kv_desc(value: str):
     ui.html(
         f'<div class="kv kv-desc kv-line" style="margin-bottom:16px">'
@@ -1602,23 +2023,117 @@ def _kv_desc(value: str):
         f'</div>'
     )
 
+class EditorMueble:
+    """Un solo diálogo de edición por página; se construye en el primer 'Editar'."""
+
+    def __init__(self, on_saved=None):
+        self.on_saved = on_saved
+        self._parent = ui.context.slot.parent  # fuera de las cards: sobrevive a borrarlas
+        self._dialog = None
+        self._cargar = None
+
+    async def abrir(self, mueble_id: int):
+        if self._dialog is None:
+            with self._parent:
+                self._dialog, self._cargar = dialog_edit_mueble(on_saved=self.on_saved)
+        await self._cargar(mueble_id)
+        self._dialog.open()
+
+
+class Lightbox:
+    """Visor a pantalla completa, uno por página: `open_with` cambia la fuente,
+    ‹ › recorre las imágenes de la pieza y se precargan las adyacentes."""
+
+    def __init__(self):
+        self.mid, self.imgs, self.imgs_var, self.index = 0, [], [], 0
+        with ui.dialog() as self.dialog:
+            # MISMO comportamiento a pantalla completa, pero ahora el contenedor es relativo
+            with ui.column().style(
+                'align-items:center; justify-content:center; '
+                'width:100vw; height:100vh; position:relative;'
+            ):
+                self.big = ui.image('').style(
+                    'max-width:90vw; max-height:90vh; object-fit:contain; '
+                    'border-radius:10px; box-shadow:0 0 20px rgba(0,0,0,.2);'
+                )
+                nav = 'top:50%; transform:translateY(-50%); z-index:2147483647; background:rgba(255,255,255,.92);'
+                self.btn_prev = ui.button('‹', on_click=lambda: self.mover(-1)) \
+                    .props('flat round size=lg aria-label="Imagen anterior"') \
+                    .classes('absolute').style('left:12px; ' + nav)
+                self.btn_next = ui.button('›', on_click=lambda: self.mover(1)) \
+                    .props('flat round size=lg aria-label="Imagen siguiente"') \
+                    .classes('absolute').style('right:12px; ' + nav)
+
+                # Botón de cierre: absoluto dentro del contenedor, notch-safe y con z-index alto
+                ui.button('✕', on_click=self.dialog.close) \
+                  .props('flat round size=lg aria-label="Cerrar imagen"') \
+                  .classes('absolute') \
+                  .style(
+                      'top:12px; right:12px; '
+                      'top: calc(constant(safe-area-inset-top) + 12px); '
+                      'top: calc(env(safe-area-inset-top) + 12px); '
+                      'right: calc(constant(safe-area-inset-right) + 12px); '
+                      'right: calc(env(safe-area-inset-right) + 12px); '
+                      'z-index:2147483647; background:rgba(255,255,255,.92);'
+                  )
+
+    def open_with(self, mid: int, imgs: list, imgs_var: list, index: int = 0):
+        self.mid, self.imgs, self.imgs_var = mid, imgs, imgs_var
+        self._mostrar(index)
+        self.dialog.open()
+
+    def mover(self, paso: int):
+        self._mostrar(self.index + paso)
+
+    def _mostrar(self, index: int):
+        n = max(len(self.imgs), 1)
+        self.index = index % n
+        ss = _srcset_props(self.imgs, self.imgs_var, self.index, '90vw')
+        self.big.props(ss) if ss else self.big.props(remove='srcset sizes')
+        self.big.set_source(_img_src(self.mid, self.imgs, self.index))
+        self.btn_prev.set_visibility(n > 1)
+        self.btn_next.set_visibility(n > 1)
+        if n > 1:
+            self._precargar({(self.index - 1) % n, (self.index + 1) % n})
+
+    def _precargar(self, indices):
+        # mismo srcset/sizes que el visor, para que el navegador baje el archivo que luego usará
+        imgs = []
+        for i in indices:
+            var = variantes.parse(self.imgs_var[i]) if i < len(self.imgs_var) else ()
+            imgs.append({'src': _img_src(self.mid, self.imgs, i),
+                         'srcset': variantes.srcset(self.imgs[i], var) if i < len(self.imgs) else ''})
+        ui.run_javascript(
+            f'{json.dumps(imgs)}.forEach(p => {{ const im = new Image(); im.sizes = "90vw"; '
+            f'if (p.srcset) im.srcset = p.srcset; im.src = p.src; }});'
+        )
+
 async def pintar_listado(vendidos=False, nombre_like=None, tienda='Todas', tipo='Todos',
                          orden='Más reciente', only_id:int|None=None, limit:int|None=None, offset:int|None=None,
                          base_origin: str | None = None,
                          precio_min:float|None=None, precio_max:float|None=None,
-                         on_change=None):
-    rows = await query_muebles(vendidos, tienda, tipo, nombre_like, orden, limit, offset,
-                               precio_min=precio_min, precio_max=precio_max)
+                         on_change=None, rows=None, lightbox: Lightbox | None = None,
+                         editor: EditorMueble | None = None):
+    # `rows` permite pintar filas ya consultadas (cargar_tanda) sin repetir la consulta
+    if rows is None:
+        rows = await query_muebles(vendidos, tienda, tipo, nombre_like, orden, limit, offset,
+                                   precio_min=precio_min, precio_max=precio_max)
     if only_id is not None:
         rows = [r for r in rows if int(r['id']) == int(only_id)]
     if not rows:
         ui.label('Sin resultados').style('color:#6b7280');  return
 
     origin = (base_origin or BASE_URL).rstrip('/')
+    if lightbox is None:
+        lightbox = Lightbox()
+    if editor is None and is_admin():
+        editor = EditorMueble(on_saved=on_change)
 
     for m in rows:
         m = dict(m)  # ← importante para poder usar .get()
         mid = int(m['id'])
+        imgs = list(m.get('imagenes') or [])
+        imgs_var = list(m.get('imagenes_var') or [])
 
         card_container = ui.element('div')
         with card_container:
@@ -1632,40 +2147,15 @@ async def pintar_listado(vendidos=False, nombre_like=None, tienda='Todas', tipo=
                     ui.html(f'<div class="mueble-price">{html.escape(_fmt_precio(m.get("precio")))}</div>')
 
                 with ui.element('div').classes('card-flex'):
-                    # ---- imagen principal + diálogo
+                    # ---- imagen principal (abre el visor compartido de la página)
                     with ui.element('div').classes('card-main'):
-                        with ui.dialog() as dialog:
-                            # MISMO comportamiento a pantalla completa, pero ahora el contenedor es relativo
-                            with ui.column().style(
-                                'align-items:center; justify-content:center; '
-                                'width:100vw; height:100vh; position:relative;'
-                            ):
-                                big = ui.image(f'/img/{mid}?i=0').style(
-                                    'max-width:90vw; max-height:90vh; object-fit:contain; '
-                                    'border-radius:10px; box-shadow:0 0 20px rgba(0,0,0,.2);'
-                                )
+                        open_with = partial(lightbox.open_with, mid, imgs, imgs_var)
 
-                                # Botón de cierre: absoluto dentro del contenedor, notch-safe y con z-index alto
-                                ui.button('✕', on_click=dialog.close) \
-                                  .props('flat round size=lg aria-label="Cerrar imagen"') \
-                                  .classes('absolute') \
-                                  .style(
-                                      'top:12px; right:12px; '
-                                      'top: calc(constant(safe-area-inset-top) + 12px); '
-                                      'top: calc(env(safe-area-inset-top) + 12px); '
-                                      'right: calc(constant(safe-area-inset-right) + 12px); '
-                                      'right: calc(env(safe-area-inset-right) + 12px); '
-                                      'z-index:2147483647; background:rgba(255,255,255,.92);'
-                                  )
-
-                        def open_with(index:int, big_img=big, mid_val=mid, dlg=dialog):
-                            big_img.set_source(f'/img/{mid_val}?i={index}')
-                            dlg.open()
-
-                        ui.image(f'/img/{mid}?i=0&thumb=1&v={THUMB_VER}') \
+                        ui.image(_img_src(mid, imgs, 0, thumb=True)) \
                             .props('loading=lazy alt="Imagen principal" onload="this.dataset.loaded=\'true\'"') \
+                            .props(_srcset_props(imgs, imgs_var, 0, '(max-width: 640px) 100vw, 520px')) \
                             .classes('card-thumb') \
-                            .on('click', lambda *_h, h=partial(open_with, 0, big, mid, dialog): h())
+                            .on('click', lambda *_h, h=partial(open_with, 0): h())
 
                     # ---- DETALLES (sin HTML raw — pares etiqueta/valor seguros)
                     try:
@@ -1716,11 +2206,7 @@ async def pintar_listado(vendidos=False, nombre_like=None, tienda='Todas', tipo=
 
                                 if is_admin():
                                     with ui.element('div').classes('mueble-actions-admin'):
-                                        d_edit, reload_edit = dialog_edit_mueble(mid, on_saved=on_change)
-                                        async def abrir_editar(_d=d_edit, _reload=reload_edit):
-                                            await _reload()
-                                            _d.open()
-                                        ui.button('Editar', on_click=abrir_editar).classes('btn-ghost')
+                                        ui.button('Editar', on_click=partial(editor.abrir, mid)).classes('btn-ghost')
 
                                         async def _on_destacado(e, _mid=mid):
                                             async with app.state.pool.acquire() as conn:
@@ -1740,6 +2226,7 @@ async def pintar_listado(vendidos=False, nombre_like=None, tienda='Todas', tipo=
                                                     'UPDATE muebles SET destacado=$1 WHERE id=$2',
                                                     e.value, _mid
                                                 )
+                                            _invalidar_api(_mid, listados=False, destacados=True)
                                         ui.switch(
                                             'Destacado',
                                             value=bool(m.get('destacado', False)),
@@ -1764,24 +2251,96 @@ async def pintar_listado(vendidos=False, nombre_like=None, tienda='Todas', tipo=
                     except Exception as e:
                         print(f"[details err id={mid}]: {e}")
 
-            # ---- MÁS IMÁGENES
-            try:
-                async with app.state.pool.acquire() as conn:
-                    total_imgs = await conn.fetchval('SELECT COUNT(*) FROM imagenes_muebles WHERE mueble_id=$1', mid)
-            except Exception as e:
-                print(f"[imgcount err id={mid}]: {e}")
-                total_imgs = 0
+            # ---- MÁS IMÁGENES (el recuento sale del array de query_muebles, sin consulta por card)
+            total_imgs = len(imgs)
 
             if total_imgs and total_imgs > 1:
-                with ui.expansion(f"Ver más imágenes ({total_imgs-1})").classes('editorial-expansion'):
-                    with ui.row().style('gap:12px; flex-wrap:wrap;'):
-                        for i in range(1, total_imgs):
-                            ui.image(f'/img/{mid}?i={i}&thumb=1&v={THUMB_VER}') \
-                              .props('loading=lazy alt="Miniatura" onload="this.dataset.loaded=\'true\'"') \
-                              .classes('thumb-skeleton') \
-                              .style('width:120px; height:120px; object-fit:cover; border-radius:3px; cursor:zoom-in; box-shadow:0 4px 12px -6px rgba(2,31,77,.35);') \
-                              .on('click', lambda *_h, h=partial(open_with, i, big, mid, dialog): h())
+                # la galería se rellena la primera vez que se despliega
+                def pintar_galeria(e, mid=mid, imgs=imgs, imgs_var=imgs_var, open_with=open_with):
+                    if not e.value or e.sender.default_slot.children:
+                        return
+                    with e.sender:
+                        with ui.row().style('gap:12px; flex-wrap:wrap;'):
+                            for i in range(1, len(imgs)):
+                                ui.image(_img_src(mid, imgs, i, thumb=True)) \
+                                  .props('loading=lazy alt="Miniatura" onload="this.dataset.loaded=\'true\'"') \
+                                  .props(_srcset_props(imgs, imgs_var, i, '120px')) \
+                                  .classes('thumb-skeleton') \
+                                  .style('width:120px; height:120px; object-fit:cover; border-radius:3px; cursor:zoom-in; box-shadow:0 4px 12px -6px rgba(2,31,77,.35);') \
+                                  .on('click', lambda *_h, h=partial(open_with, i): h())
+                ui.expansion(f"Ver más imágenes ({total_imgs-1})", on_value_change=pintar_galeria) \
+                    .classes('editorial-expansion')
+
+
+
+async def cargar_tanda(container, *, vendidos: bool | None, tienda: str | None, tipo: str | None,
+                       nombre_like: str | None, orden: str, precio_min: float | None = None,
+                       precio_max: float | None = None, cursor: str | None = None, **pintar_kw):
+    """Una tanda de 'Cargar más': una sola consulta (PAGE_SIZE+1 filas para saber si hay
+    más) y pintado de esas filas en `container` sin consultas adicionales.
+
+    Devuelve (hay_más, cursor para la siguiente tanda)."""
+    consulta = partial(query_muebles, vendidos=vendidos, tienda=tienda, tipo=tipo,
+                       nombre_like=nombre_like, orden=orden, limit=PAGE_SIZE+1,
+                       precio_min=precio_min, precio_max=precio_max)
+    try:
+        rows = await consulta(after=cursor)
+    except ValueError:
+        # cursor de otro orden (cambió el filtro entre tandas): empezamos de nuevo
+        rows = await consulta()
+    page = rows[:PAGE_SIZE]
+    with container:
+        await pintar_listado(rows=page, **pintar_kw)
+    if page:
+        cursor = _encode_cursor(orden, page[-1])
+    return len(rows) > PAGE_SIZE, cursor
+
+
+class RefrescoControlador:
+    """Como mucho un refresco del listado en curso por cliente.
+
+    `programar(espera)` cancela el refresco anterior (en espera o a medias) y lanza
+    uno nuevo tras `espera` segundos: los cambios rápidos de filtro acaban en una
+    sola consulta. `lanzar()` registra tareas secundarias ('Cargar más') para que
+    un refresco nuevo también las cancele.
+    """
+
+    def __init__(self, refrescar):
+        self._refrescar = refrescar
+        self._actual: asyncio.Task | None = None
+        self._extra: set[asyncio.Task] = set()
+
+    def programar(self, espera: float = 0.0) -> asyncio.Task:
+        self.cancelar()
+        self._actual = asyncio.create_task(self._tras(espera))
+        return self._actual
+
+    async def _tras(self, espera: float):
+        if espera:
+            await asyncio.sleep(espera)
+        await self._refrescar()
+
+    async def ahora(self):
+        """Refresca ya y espera a que termine (tras guardar en los diálogos)."""
+        tarea = self.programar(0)
+        try:
+            await tarea
+        except asyncio.CancelledError:
+            # solo se ignora si lo ha sustituido otro refresco; si cancelan a quien espera, se propaga
+            if tarea.cancelled() and not asyncio.current_task().cancelling():
+                return
+            raise
 
+    def lanzar(self, coro) -> asyncio.Task:
+        t = asyncio.create_task(coro)
+        self._extra.add(t)
+        t.add_done_callback(self._extra.discard)
+        return t
+
+    def cancelar(self):
+        for t in [self._actual, *self._extra]:
+            if t is not None and not t.done():
+                t.cancel()
 
 
 # ---------- Página ----------
@@ -1799,6 +2358,7 @@ async def index(request: Request):
     """)
 
     base_origin = _origin_from(request)  # <- mismo host
+    lightbox = Lightbox()  # un único visor de imágenes para todas las cards
 
     # Si llega con ?id=... renderiza ese mueble
     item_id = request.query_params.get('id')
@@ -1810,9 +2370,12 @@ async def index(request: Request):
         with cont:
             await pintar_listado(vendidos=None, nombre_like=None, tienda=None, tipo=None,
                                  orden='Más reciente', only_id=mid if item_id else None,
-                                 base_origin=base_origin)
+                                 base_origin=base_origin, lightbox=lightbox,
+                                 editor=EditorMueble() if is_admin() else None)
         return
 
+    editor = EditorMueble(on_saved=lambda: refresco.ahora()) if is_admin() else None
+
     # Drawer admin
     with ui.left_drawer(value=False) as drawer:
         drawer.props('overlay')
@@ -1845,32 +2408,37 @@ async def index(request: Request):
             stats_box = ui.column().classes('q-mt-md')
             async def cargar_stats():
                 stats_box.clear()
-                async with app.state.pool.acquire() as conn:
-                    en_rastro = await conn.fetchval("SELECT COUNT(*) FROM muebles WHERE vendido=FALSE AND tienda='El Rastro'")
-                    en_regueros = await conn.fetchval("SELECT COUNT(*) FROM muebles WHERE vendido=FALSE AND tienda='Regueros'")
-                    vendidos = await conn.fetchval("SELECT COUNT(*) FROM muebles WHERE vendido=TRUE")
+                st = await query_stats()
+                vacia = {'disponibles': 0, 'valor': 0.0}
+                rastro = st['por_tienda'].get('El Rastro', vacia)
+                regueros = st['por_tienda'].get('Regueros', vacia)
                 with stats_box:
                     ui.label('📊 Estadísticas').classes('text-subtitle1 q-mb-sm')
-                    ui.label(f"🔵 En El Rastro: {en_rastro}")
-                    ui.label(f"🔴 En Regueros: {en_regueros}")
-                    ui.label(f"💰 Vendidos: {vendidos}")
-
-                    async def export_csv(_=None):
-                        rows = await query_muebles(
-                            vendidos=None,
-                            tienda=filtro_tienda.value,
-                            tipo=filtro_tipo.value,
-                            nombre_like=filtro_nombre.value,
-                            orden=orden.value,
-                        )
-                        if not rows:
-                            ui.notify('No hay datos', type='warning'); return
-                        df = pd.DataFrame([dict(r) for r in rows])
-                        csv = df.to_csv(index=False)
-                        ui.download(bytes(csv, 'utf-8'), filename='muebles.csv')
-                    ui.button('⬇️ Exportar inventario CSV', on_click=export_csv).classes('q-mt-sm')
-
-                    ui.button('➕ Añadir nueva antigüedad', on_click=lambda: dialog_add_mueble(on_saved=refrescar).open()).classes('q-mt-sm')
+                    ui.label(f"🔵 En El Rastro: {rastro['disponibles']} ({_fmt_precio(rastro['valor'])})")
+                    ui.label(f"🔴 En Regueros: {regueros['disponibles']} ({_fmt_precio(regueros['valor'])})")
+                    ui.label(f"💰 Vendidos: {st['vendidos']}")
+                    if st['dias_venta'] is not None:
+                        ui.label(f"⏱️ Días medios hasta la venta: {st['dias_venta']:g}")
+                    with ui.expansion('Por tipo').classes('w-full'):
+                        for tipo, c in st['por_tipo'].items():
+                            ui.label(f"{tipo}: {c['disponibles']} disponibles · {c['vendidos']} vendidos") \
+                                .classes('text-caption')
+
+                    def exportar_url(formato: str) -> str:
+                        # la descarga la sirve /admin/export en streaming, con los filtros actuales
+                        filtros = {'tienda': filtro_tienda.value, 'tipo': filtro_tipo.value,
+                                   'q': filtro_nombre.value, 'orden': orden.value,
+                                   'precio_min': _f(filtro_precio_min.value),
+                                   'precio_max': _f(filtro_precio_max.value)}
+                        qs = urllib.parse.urlencode({k: v for k, v in filtros.items() if v not in (None, '')})
+                        return f'/admin/export.{formato}?{qs}'
+                    ui.button('⬇️ Exportar inventario CSV',
+                              on_click=lambda: ui.download(exportar_url('csv'))).classes('q-mt-sm')
+                    if exportar.HAS_PARQUET:
+                        ui.button('⬇️ Exportar Parquet',
+                                  on_click=lambda: ui.download(exportar_url('parquet'))).props('flat')
+
+                    ui.button('➕ Añadir nueva antigüedad', on_click=lambda: dialog_add_mueble(on_saved=refresco.ahora).open()).classes('q-mt-sm')
 
             ui.timer(0.1, lambda: asyncio.create_task(cargar_stats()), once=True)
 
@@ -1894,17 +2462,17 @@ async def index(request: Request):
                     .classes('advisor-fab')
 
             if is_admin():
-                ui.button('Añadir nueva antigüedad', on_click=lambda: dialog_add_mueble(on_saved=refrescar).open()) \
+                ui.button('Añadir nueva antigüedad', on_click=lambda: dialog_add_mueble(on_saved=refresco.ahora).open()) \
                     .classes('btn-primary-editorial q-mb-md')
 
             with ui.element('details').classes('filtros-panel'):
                 with ui.element('summary').classes('filtros-summary'):
                     ui.label('🔍 Filtrar el inventario')
                 with ui.row().style('gap:18px; flex-wrap:wrap;'):
-                    filtro_nombre = ui.input('Buscar por nombre').props('clearable').style('min-width:200px;')
+                    filtro_nombre = ui.input('Buscar').props('clearable').style('min-width:200px;')
                     filtro_tienda = ui.select(['Todas','El Rastro','Regueros'], value='Todas', label='Filtrar por tienda').style('min-width:180px;')
                     filtro_tipo = ui.select(['Todos'], value='Todos', label='Filtrar por tipo').style('min-width:180px;')
-                    orden = ui.select(['Más reciente','Más antiguo','Precio ↑','Precio ↓'], value='Más reciente', label='Ordenar por').style('min-width:180px;')
+                    orden = ui.select(list(ORDENES), value='Más reciente', label='Ordenar por').style('min-width:180px;')
                     filtro_precio_min = ui.number(label='Precio mín (€)', min=0, format='%.2f').props('clearable').style('min-width:140px;')
                     filtro_precio_max = ui.number(label='Precio máx (€)', min=0, format='%.2f').props('clearable').style('min-width:140px;')
 
@@ -1920,27 +2488,19 @@ async def index(request: Request):
             list_sold = ui.column()
 
             def reset_offsets():
-                app.storage.user['off_unsold'] = 0
-                app.storage.user['off_sold'] = 0
+                app.storage.user['cur_unsold'] = None
+                app.storage.user['cur_sold'] = None
 
             def _f(v):
                 return float(v) if v not in (None, '') else None
 
-            async def cargar_tanda(vendidos_flag: bool, container: ui.element, off_key: str):
-                offset = int(app.storage.user.get(off_key, 0))
-                pmin, pmax = _f(filtro_precio_min.value), _f(filtro_precio_max.value)
-                rows = await query_muebles(vendidos=vendidos_flag, tienda=filtro_tienda.value,
-                                           tipo=filtro_tipo.value, nombre_like=filtro_nombre.value,
-                                           orden=orden.value, limit=PAGE_SIZE+1, offset=offset,
-                                           precio_min=pmin, precio_max=pmax)
-                has_more = len(rows) > PAGE_SIZE
-                with container:
-                    await pintar_listado(vendidos=vendidos_flag, nombre_like=filtro_nombre.value,
-                                         tienda=filtro_tienda.value, tipo=filtro_tipo.value, orden=orden.value,
-                                         limit=PAGE_SIZE, offset=offset, base_origin=base_origin,
-                                         precio_min=pmin, precio_max=pmax,
-                                         on_change=refrescar)
-                app.storage.user[off_key] = offset + PAGE_SIZE
+            async def cargar(vendidos_flag: bool, container: ui.element, cur_key: str):
+                has_more, app.storage.user[cur_key] = await cargar_tanda(
+                    container, vendidos=vendidos_flag, tienda=filtro_tienda.value,
+                    tipo=filtro_tipo.value, nombre_like=filtro_nombre.value, orden=orden.value,
+                    precio_min=_f(filtro_precio_min.value), precio_max=_f(filtro_precio_max.value),
+                    cursor=app.storage.user.get(cur_key),
+                    base_origin=base_origin, on_change=refresco.ahora, lightbox=lightbox, editor=editor)
                 return has_more
 
             async def refrescar(*_):
@@ -1948,43 +2508,82 @@ async def index(request: Request):
                 cont.clear(); list_unsold.clear(); list_sold.clear()
                 with cont:
                     with list_unsold:
-                        has_more_unsold = await cargar_tanda(False, list_unsold, 'off_unsold')
+                        has_more_unsold = await cargar(False, list_unsold, 'cur_unsold')
                         if has_more_unsold:
                             row_more = ui.row().style('justify-content:center; margin:12px 0;')
                             def more_unsold():
                                 async def go():
                                     row_more.clear()
-                                    hm = await cargar_tanda(False, list_unsold, 'off_unsold')
+                                    hm = await cargar(False, list_unsold, 'cur_unsold')
                                     if hm:
                                         with row_more: ui.button('Cargar más', on_click=more_unsold)
-                                asyncio.create_task(go())
+                                refresco.lanzar(go())
                             with row_more: ui.button('Cargar más', on_click=more_unsold)
 
                     if is_admin():
                         ui.separator()
                         with list_sold:
-                            has_more_sold = await cargar_tanda(True, list_sold, 'off_sold')
+                            has_more_sold = await cargar(True, list_sold, 'cur_sold')
                             if has_more_sold:
                                 row_more_s = ui.row().style('justify-content:center; margin:12px 0;')
                                 def more_sold():
                                     async def go():
                                         row_more_s.clear()
-                                        hm = await cargar_tanda(True, list_sold, 'off_sold')
+                                        hm = await cargar(True, list_sold, 'cur_sold')
                                         if hm:
                                             with row_more_s: ui.button('Cargar más', on_click=more_sold)
-                                    asyncio.create_task(go())
+                                    refresco.lanzar(go())
                                 with row_more_s: ui.button('Cargar más', on_click=more_sold)
 
-            filtro_nombre.on('blur', lambda e: asyncio.create_task(refrescar()))
-            filtro_tienda.on('blur', lambda e: asyncio.create_task(refrescar()))
-            filtro_tipo.on('blur', lambda e: asyncio.create_task(refrescar()))
-            orden.on('blur', lambda e: asyncio.create_task(refrescar()))
-            filtro_precio_min.on('blur', lambda e: asyncio.create_task(refrescar()))
-            filtro_precio_max.on('blur', lambda e: asyncio.create_task(refrescar()))
-            ui.timer(0.05, lambda: asyncio.create_task(refrescar()), once=True)
+            refresco = RefrescoControlador(refrescar)
+            ui.context.client.on_delete(refresco.cancelar)  # no en on_disconnect: un corte breve reconecta
+
+            # búsqueda mientras se escribe (con debounce); selects al momento
+            filtro_nombre.on_value_change(lambda e: refresco.programar(0.4))
+            filtro_nombre.on('keydown.enter', lambda e: refresco.programar(0))
+            filtro_tienda.on_value_change(lambda e: refresco.programar(0))
+            filtro_tipo.on_value_change(lambda e: refresco.programar(0))
+            orden.on_value_change(lambda e: refresco.programar(0))
+            filtro_precio_min.on_value_change(lambda e: refresco.programar(0.6))
+            filtro_precio_max.on_value_change(lambda e: refresco.programar(0.6))
+            ui.timer(0.05, lambda: refresco.programar(0), once=True)
             ui.timer(2.0, show_ios_install_banner, once=True)
 
 
+@app.get('/admin/export.{formato}')
+async def admin_export(formato: str, tienda: str | None = None, tipo: str | None = None,
+                       q: str | None = None, orden: str = 'Más reciente', vendidos: bool | None = None,
+                       precio_min: float | None = None, precio_max: float | None = None):
+    if not is_admin():
+        return Response('Forbidden', status_code=status.HTTP_403_FORBIDDEN, media_type='text/plain')
+    if formato == 'csv':
+        stream, media = exportar.csv_stream, 'text/csv; charset=utf-8'
+    elif formato == 'parquet' and exportar.HAS_PARQUET:
+        stream, media = exportar.parquet_stream, 'application/vnd.apache.parquet'
+    else:
+        return Response('Formato no disponible', status_code=status.HTTP_404_NOT_FOUND, media_type='text/plain')
+
+    params = []
+    where = _where_muebles(params, vendidos, tienda, tipo, q, precio_min, precio_max)
+    if ORDENES.get(orden, ('',))[0] == 'rank':
+        order_sql = f"{busqueda.ranking(q, params)} DESC, id DESC"
+    else:
+        order_sql = _order_sql(orden)
+    sql = f"SELECT * FROM muebles WHERE {' AND '.join(where) or 'TRUE'} ORDER BY {order_sql}"
+
+    async def cuerpo():
+        # conexión propia durante toda la descarga; los cursores exigen transacción
+        async with app.state.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                stmt = await conn.prepare(sql)
+                async for trozo in stream(stmt, params):
+                    yield trozo
+
+    nombre = f"muebles_{datetime.now():%Y%m%d}.{formato}"
+    return StreamingResponse(cuerpo(), media_type=media,
+                             headers={'Content-Disposition': f'attachment; filename="{nombre}"'})
+
+
 @ui.page('/asesor')
 async def asesor_page():
     ui.add_head_html(HEAD_HTML)
@@ -1993,19 +2592,106 @@ async def asesor_page():
 
 # ---------- API REST pública ----------
 
+# ---- Caché de respuestas: clave = (ruta, parámetros normalizados) ----
+API_CACHE = TTLCache(maxsize=512, ttl=60)
+API_TTL = {'muebles': 60, 'destacados': 60, 'mueble': 300, 'categorias': 3600}
+_api_mtime = time.time()  # última escritura en inventario -> Last-Modified
+_api_version = 0          # sube en cada invalidación: una respuesta producida antes no se guarda
+
+def _invalidar_api(mueble_id: int | None = None, *, listados: bool = True, destacados: bool = False):
+    """Borra las respuestas afectadas por una escritura.
+    - listados: todos los /api/muebles (cambian total y páginas).
+    - destacados: /api/muebles/destacados aunque no incluyera la pieza (toggle).
+    - mueble_id: su ficha y cualquier respuesta cacheada que la incluya."""
+    global _api_mtime, _api_version
+    _api_mtime = time.time()
+    _api_version += 1
+    def afectada(k):
+        if listados and k[0] == 'muebles':
+            return True
+        if destacados and k[0] == 'destacados':
+            return True
+        if mueble_id is not None:
+            if k == ('mueble', mueble_id):
+                return True
+            entry = API_CACHE.peek(k)
+            return bool(entry) and mueble_id in entry['ids']
+        return False
+    API_CACHE.invalidate_where(afectada)
+
+def _ids_en(payload) -> frozenset:
+    if isinstance(payload, dict):
+        if 'items' in payload:
+            return frozenset(int(it['id']) for it in payload['items'] if 'id' in it)
+        if 'id' in payload:
+            return frozenset([int(payload['id'])])
+    return frozenset()
+
+def _no_modificada(request: Request, entry: dict) -> bool:
+    inm = request.headers.get('if-none-match')
+    if inm:
+        return entry['etag'] in [t.strip() for t in inm.split(',')] or inm.strip() == '*'
+    ims = request.headers.get('if-modified-since')
+    if ims:
+        try:
+            return int(entry['mtime']) <= parsedate_to_datetime(ims).timestamp()
+        except Exception:
+            return False
+    return False
+
+async def _api_cacheada(request: Request, key: tuple, producir):
+    """Sirve `key` desde la caché (o 304) y solo llama a `producir()` -> JSONResponse si falta."""
+    entry = API_CACHE.get(key)
+    if entry is None:
+        version = _api_version
+        resp = await producir()
+        if resp.status_code not in (200, 404):
+            return resp  # errores: ni se cachean ni llevan validadores
+        body = bytes(resp.body)
+        entry = {
+            'body': body,
+            'status': resp.status_code,
+            'etag': 'W/"%s"' % hashlib.md5(body).hexdigest(),
+            'mtime': _api_mtime,
+            'ids': _ids_en(json.loads(body)),
+        }
+        if version == _api_version:  # si hubo una escritura mientras tanto, puede estar obsoleta
+            API_CACHE.set(key, entry, ttl=API_TTL.get(key[0]))
+    headers = {
+        'ETag': entry['etag'],
+        'Last-Modified': formatdate(entry['mtime'], usegmt=True),
+        'Cache-Control': 'no-cache',  # el cliente puede guardarla, pero revalida (304 barato)
+    }
+    if entry['status'] == 200 and _no_modificada(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(entry['body'], status_code=entry['status'],
+                    media_type='application/json', headers=headers)
+
+
 @app.get('/api/categorias')
-async def api_categorias():
-    return JSONResponse({"categorias": TIPOS})
+async def api_categorias(request: Request):
+    async def producir():
+        conteos = await conteos_tipos()
+        cero = {'total': 0, 'disponibles': 0}
+        return JSONResponse({
+            "categorias": TIPOS,
+            "conteos": {t: conteos.get(t, cero) for t in TIPOS},
+        })
+    return await _api_cacheada(request, ('categorias',), producir)
 
 
 @app.get('/api/muebles/destacados')
-async def api_destacados():
+async def api_destacados(request: Request):
+    return await _api_cacheada(request, ('destacados',), _api_destacados_db)
+
+
+async def _api_destacados_db():
     try:
         async with app.state.pool.acquire() as conn:
             rows = await conn.fetch(
                 """
                 SELECT m.id, m.nombre, m.tipo, m.tienda, m.precio,
-                       i.imagen_url
+                       i.imagen_url, i.variantes
                 FROM muebles m
                 LEFT JOIN imagenes_muebles i
                     ON i.mueble_id = m.id
@@ -2028,6 +2714,7 @@ async def api_destacados():
                 "tienda": r['tienda'],
                 "precio": float(r['precio']) if r['precio'] is not None else None,
                 "imagen_url": r['imagen_url'],
+                "imagen_srcset": variantes.srcset(r['imagen_url'], variantes.parse(r['variantes'])),
             }
             for r in rows
         ]
@@ -2039,13 +2726,25 @@ async def api_destacados():
 
 @app.get('/api/muebles')
 async def api_muebles(
+    request: Request,
     categoria: str | None = None,
     pagina: int = 1,
     limite: int = 20,
     precio_min: float | None = None,
     precio_max: float | None = None,
     q: str | None = None,
+    cursor: str | None = None,
 ):
+    """Listado paginado. `cursor` (el `next_cursor` de la respuesta anterior) tiene
+    preferencia sobre `pagina`, que se mantiene para el paginador numérico del frontend."""
+    q = ' '.join((q or '').lower().split()) or None
+    key = ('muebles', categoria or None, None if cursor else pagina, limite,
+           precio_min, precio_max, q, cursor or None)
+    return await _api_cacheada(request, key, partial(
+        _api_muebles_db, categoria, pagina, limite, precio_min, precio_max, q, cursor))
+
+
+async def _api_muebles_db(categoria, pagina, limite, precio_min, precio_max, q, cursor):
     try:
         where, params = ["vendido = FALSE"], []
         if categoria:
@@ -2057,12 +2756,25 @@ async def api_muebles(
         if precio_max is not None:
             params.append(precio_max)
             where.append(f'precio <= ${len(params)}')
-        if q:
-            params.append(f'%{q.strip().lower()}%')
-            where.append(f'LOWER(nombre) LIKE ${len(params)}')
+        if q and q.strip():
+            where.append(busqueda.condicion(q, params))
         where_sql = 'WHERE ' + ' AND '.join(where)
-        offset = (pagina - 1) * limite
-        params_page = params + [limite, offset]
+        # Con búsqueda se ordena por relevancia; sin ella, lo más reciente primero
+        orden = 'Relevancia' if q and q.strip() else 'Más reciente'
+        params_page = list(params)
+        rank_sql = busqueda.ranking(q, params_page, alias='m.')
+        page_sql = where_sql
+        if cursor:
+            try:
+                cur = _decode_cursor(cursor, orden)
+            except ValueError:
+                return JSONResponse({"error": "Cursor no válido"}, status_code=400)
+            page_sql += ' AND ' + _keyset_where(orden, cur, params_page, alias='m.', rank_sql=rank_sql)
+            params_page.append(limite + 1)
+            limit_sql = f'LIMIT ${len(params_page)}'
+        else:
+            params_page += [limite + 1, (pagina - 1) * limite]
+            limit_sql = f'LIMIT ${len(params_page) - 1} OFFSET ${len(params_page)}'
         async with app.state.pool.acquire() as conn:
             total = await conn.fetchval(
                 f'SELECT COUNT(*) FROM muebles {where_sql}', *params
@@ -2070,7 +2782,7 @@ async def api_muebles(
             rows = await conn.fetch(
                 f"""
                 SELECT m.id, m.nombre, m.tipo, m.tienda, m.precio,
-                       i.imagen_url
+                       i.imagen_url, i.variantes, {rank_sql} AS rank
                 FROM muebles m
                 LEFT JOIN imagenes_muebles i
                     ON i.mueble_id = m.id
@@ -2080,12 +2792,14 @@ async def api_muebles(
                         ORDER BY es_principal DESC, id ASC
                         LIMIT 1
                     )
-                {where_sql}
-                ORDER BY m.id DESC
-                LIMIT ${len(params_page) - 1} OFFSET ${len(params_page)}
+                {page_sql}
+                ORDER BY {_order_sql(orden, alias='m.')}
+                {limit_sql}
                 """,
                 *params_page
             )
+        next_cursor = _encode_cursor(orden, rows[limite - 1]) if len(rows) > limite else None
+        rows = rows[:limite]
         items = [
             {
                 "id": r['id'],
@@ -2094,17 +2808,23 @@ async def api_muebles(
                 "tienda": r['tienda'],
                 "precio": float(r['precio']) if r['precio'] is not None else None,
                 "imagen_url": r['imagen_url'],
+                "imagen_srcset": variantes.srcset(r['imagen_url'], variantes.parse(r['variantes'])),
             }
             for r in rows
         ]
-        return JSONResponse({"total": total, "pagina": pagina, "limite": limite, "items": items})
+        return JSONResponse({"total": total, "pagina": pagina, "limite": limite,
+                             "next_cursor": next_cursor, "items": items})
     except Exception as e:
         print(f"[api_muebles] ERROR: {e}")
         return JSONResponse({"error": "Error interno"}, status_code=500)
 
 
 @app.get('/api/mueble/{mueble_id}')
-async def api_mueble(mueble_id: int):
+async def api_mueble(request: Request, mueble_id: int):
+    return await _api_cacheada(request, ('mueble', mueble_id), partial(_api_mueble_db, mueble_id))
+
+
+async def _api_mueble_db(mueble_id: int):
     try:
         async with app.state.pool.acquire() as conn:
             m = await conn.fetchrow(
@@ -2113,8 +2833,9 @@ async def api_mueble(mueble_id: int):
             if not m:
                 return JSONResponse({"error": "No encontrado"}, status_code=404)
             imgs = await conn.fetch(
-                """SELECT imagen_url FROM imagenes_muebles
-                   WHERE mueble_id=$1 ORDER BY es_principal DESC, id ASC""",
+                """SELECT imagen_url, variantes FROM imagenes_muebles
+                   WHERE mueble_id=$1 AND imagen_url IS NOT NULL
+                   ORDER BY es_principal DESC, id ASC""",
                 mueble_id
             )
         return JSONResponse({
@@ -2128,7 +2849,8 @@ async def api_mueble(mueble_id: int):
             "alto": m['alto'],
             "fondo": m['fondo'],
             "destacado": m['destacado'],
-            "imagenes": [r['imagen_url'] for r in imgs if r['imagen_url']],
+            "imagenes": [r['imagen_url'] for r in imgs],
+            "imagenes_srcset": [variantes.srcset(r['imagen_url'], variantes.parse(r['variantes'])) for r in imgs],
         })
     except Exception as e:
         print(f"[api_mueble] ERROR id={mueble_id}: {e}")
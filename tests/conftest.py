@@ -0,0 +1,88 @@
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeConn:
+    """Conexión asyncpg de mentira: anota cada consulta y responde con `pool.responder`."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def _q(self, kind, sql, args):
+        self.pool.calls.append((kind, ' '.join(sql.split()), args))
+        return self.pool.responder(kind, sql, args)
+
+    async def fetch(self, sql, *args):
+        return await self._q('fetch', sql, args) or []
+
+    async def fetchrow(self, sql, *args):
+        return await self._q('fetchrow', sql, args)
+
+    async def fetchval(self, sql, *args):
+        return await self._q('fetchval', sql, args)
+
+    async def execute(self, sql, *args):
+        return await self._q('execute', sql, args)
+
+    @asynccontextmanager
+    async def transaction(self, **_):
+        yield
+
+
+class FakePool:
+    def __init__(self, responder=None):
+        self.calls = []
+        self.responder = responder or (lambda kind, sql, args: None)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConn(self)
+
+    async def fetch(self, sql, *args):
+        return await FakeConn(self).fetch(sql, *args)
+
+    async def fetchval(self, sql, *args):
+        return await FakeConn(self).fetchval(sql, *args)
+
+    async def execute(self, sql, *args):
+        return await FakeConn(self).execute(sql, *args)
+
+    def count(self, kind=None):
+        return sum(1 for k, _, _ in self.calls if kind is None or k == kind)
+
+
+def fila_mueble(mid: int, n_imgs: int = 3) -> dict:
+    return {
+        'id': mid, 'nombre': f'Mueble {mid}', 'precio': 100 + mid, 'descripcion': 'Nogal, buen estado',
+        'tienda': 'El Rastro', 'tipo': 'Cómodas', 'fecha': None, 'vendido': False, 'destacado': False,
+        'alto': 80, 'largo': 120, 'fondo': 50, 'diametro': None, 'diametro_base': None,
+        'diametro_boca': None, 'alto_respaldo': None, 'alto_asiento': None, 'ancho': None,
+        'imagenes': [f'https://r2.example/{mid}_{i}.webp' for i in range(n_imgs)],
+        'imagenes_var': ['160,360,720,1200'] * n_imgs,
+    }
+
+
+@pytest.fixture
+def fake_pool():
+    return FakePool()
+
+
+@pytest.fixture
+def main_mod(monkeypatch, fake_pool):
+    import main
+    monkeypatch.setattr(main.app.state, 'pool', fake_pool, raising=False)
+    monkeypatch.setattr(main, 'is_admin', lambda: False)
+    return main
+
+
+@pytest.fixture
+def cliente():
+    """Cliente NiceGUI sin servidor: basta para crear y contar elementos."""
+    from nicegui import Client
+    from nicegui.page import page
+    return Client(page('/'), request=None)
@@ -0,0 +1,44 @@
+import warnings
+
+from starlette.testclient import TestClient
+
+
+def test_categorias_contrato_fijo_con_conteos(main_mod, fake_pool, monkeypatch):
+    monkeypatch.setattr(main_mod, '_TIPOS_CONTEOS', {
+        'Cómodas': {'total': 4, 'disponibles': 3},
+        'tipo libre antiguo': {'total': 1, 'disponibles': 1},
+    })
+    main_mod.API_CACHE.clear()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        r = TestClient(main_mod.app).get('/api/categorias')
+    body = r.json()
+    assert body['categorias'] == main_mod.TIPOS
+    assert body['conteos']['Cómodas'] == {'total': 4, 'disponibles': 3}
+    assert body['conteos']['Espejos'] == {'total': 0, 'disponibles': 0}
+    assert 'tipo libre antiguo' not in body['conteos']
+    assert fake_pool.calls == []
+
+
+def test_respuesta_producida_durante_una_escritura_no_se_cachea(main_mod):
+    import asyncio
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+
+    main_mod.API_CACHE.clear()
+    peticion = Request({'type': 'http', 'method': 'GET', 'path': '/api/mueble/5', 'headers': []})
+
+    async def producir_con_escritura():
+        main_mod._invalidar_api(5)  # una escritura llega mientras se consulta la BD
+        return JSONResponse({'id': 5, 'precio': 100})
+
+    async def producir():
+        return JSONResponse({'id': 5, 'precio': 120})
+
+    async def run():
+        r1 = await main_mod._api_cacheada(peticion, ('mueble', 5), producir_con_escritura)
+        assert r1.status_code == 200
+        assert main_mod.API_CACHE.peek(('mueble', 5)) is None
+        await main_mod._api_cacheada(peticion, ('mueble', 5), producir)
+        return main_mod.API_CACHE.peek(('mueble', 5))
+    assert b'120' in asyncio.run(run())['body']
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import re
+
+from conftest import FakePool
+
+import asesor_estilo
+from asesor_estilo import IndiceBM25, StyleAdvisor
+from ejecutor_gemini import EjecutorGemini
+
+DOCS = [
+    {'id': 9, 'nombre': 'Cómoda art déco', 'tipo': 'Cómodas', 'precio': 900, 'descripcion': 'Nogal', 'tienda': 'El Rastro'},
+    {'id': 8, 'nombre': 'Mesa de comedor', 'tipo': 'Mesas', 'precio': 600, 'descripcion': 'Roble extensible', 'tienda': 'Regueros'},
+    {'id': 7, 'nombre': 'Espejo isabelino', 'tipo': 'Espejos', 'precio': 300, 'descripcion': 'Dorado, ideal para recibidor', 'tienda': 'El Rastro'},
+    {'id': 6, 'nombre': 'Consola estrecha', 'tipo': 'Consolas', 'precio': 450, 'descripcion': 'Para recibidor pequeño', 'tienda': 'Regueros'},
+    {'id': 5, 'nombre': 'Sillón inglés', 'tipo': 'Asientos', 'precio': 350, 'descripcion': 'Cuero, junto a una cómoda', 'tienda': 'El Rastro'},
+    {'id': 4, 'nombre': 'Cómoda isabelina', 'tipo': 'Cómodas', 'precio': 700, 'descripcion': 'Caoba', 'tienda': 'Regueros'},
+]
+
+
+class _Trozo:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModelo:
+    """Modelo de mentira con la interfaz de genai: start_chat() -> send_message(stream=True)."""
+
+    def __init__(self, trozos=('Le recomiendo ', 'la cómoda [ID:9].')):
+        self.trozos = list(trozos)
+        self.enviados = []
+        self.system_instructions = []
+
+    def __call__(self, system_instruction):
+        self.system_instructions.append(system_instruction)
+        return self
+
+    def start_chat(self, history):
+        modelo = self
+
+        class _Chat:
+            def send_message(self, mensaje, stream=False):
+                modelo.enviados.append(mensaje)
+                for t in modelo.trozos:
+                    yield _Trozo(t)
+        return _Chat()
+
+
+def _asesor(modelo=None, docs=DOCS):
+    pool = FakePool(lambda kind, sql, args: [dict(d) for d in docs] if 'FROM muebles' in sql else None)
+    modelo = modelo or FakeModelo()
+    adv = StyleAdvisor('', pool, model_factory=modelo, ejecutor=EjecutorGemini(backoff=0))
+    return adv, modelo, pool
+
+
+def _ids_enviados(mensaje: str) -> list[int]:
+    piezas = json.loads(re.search(r'consulta: (\[.*\])\]$', mensaje, re.S).group(1))
+    return [p['id'] for p in piezas]
+
+
+# ---------- Recuperación (BM25) ----------
+
+def test_bm25_sin_tildes_ni_plurales():
+    ix = IndiceBM25(DOCS)
+    assert {d['id'] for d in ix.buscar('¿Tenéis cómodas?')[:2]} == {9, 4}
+    assert [d['id'] for d in ix.buscar('algo para un recibidor pequeño')][0] == 6
+    assert [d['id'] for d in ix.buscar('mesas de roble')][0] == 8
+
+
+def test_bm25_nombre_pesa_mas_que_descripcion():
+    ids = [d['id'] for d in IndiceBM25(DOCS).buscar('comoda')]
+    assert ids.index(5) > ids.index(9) and ids.index(5) > ids.index(4)  # 5 solo la cita en la descripción
+
+
+def test_bm25_sin_coincidencias():
+    assert IndiceBM25(DOCS).buscar('piano de cola') == []
+
+
+def test_candidatas_completa_con_la_pregunta_anterior():
+    adv, _, _ = _asesor()
+    historial = [{'role': 'user', 'content': 'busco un espejo'},
+                 {'role': 'assistant', 'content': 'Tenemos el [ID:7]'}]
+    ids = [d['id'] for d in asyncio.run(adv.candidatas('y una mesa', historial, k=3))]
+    assert ids[0] == 8   # primero lo de la pregunta actual
+    assert 7 in ids      # y se completa con lo de la anterior
+
+
+def test_candidatas_sin_coincidencias_da_las_mas_recientes():
+    adv, _, _ = _asesor()
+    ids = [d['id'] for d in asyncio.run(adv.candidatas('piano de cola', [], k=2))]
+    assert ids == [9, 8]
+
+
+def test_chat_envia_solo_las_candidatas():
+    otras = [dict(DOCS[1], id=100 + i, nombre=f'Mesa {i}') for i in range(30)]
+    adv, modelo, _ = _asesor(docs=otras + DOCS)
+    asyncio.run(adv.chat('cómoda isabelina', []))
+    enviados = _ids_enviados(modelo.enviados[0])
+    assert enviados[0] == 4
+    assert set(enviados) == {4, 9, 5, 7}  # ninguna de las 30 mesas viaja en el prompt
+    assert len(enviados) <= asesor_estilo.TOP_K
+
+
+def test_modelo_se_construye_una_vez():
+    adv, modelo, _ = _asesor()
+
+    async def run():
+        await adv.chat('cómoda', [])
+        await adv.chat('mesa', [])
+    asyncio.run(run())
+    assert len(modelo.system_instructions) == 1
+    assert len(modelo.enviados) == 2
+
+
+# ---------- Streaming ----------
+
+class FakeModeloLento(FakeModelo):
+    def __init__(self, trozos, pausa=0.02):
+        super().__init__(trozos)
+        self.pausa = pausa
+
+    def start_chat(self, history):
+        modelo = self
+
+        class _Chat:
+            def send_message(self, mensaje, stream=False):
+                import time
+                for t in modelo.trozos:
+                    time.sleep(modelo.pausa)
+                    yield _Trozo(t)
+        return _Chat()
+
+
+def test_stream_en_orden_y_mide_ttft():
+    trozos = ['Le ', 'propongo ', 'la [ID:', '9]', ' y la [ID:4].']
+    adv, _, _ = _asesor(FakeModeloLento(trozos))
+
+    async def run():
+        return [t async for t in adv.chat_stream('cómoda', [])]
+    assert asyncio.run(run()) == trozos
+    m = adv.metricas()
+    assert m['turnos'] == 1
+    assert m['ttft_ms_p50'] is not None and m['ttft_ms_p50'] <= m['total_ms_p50']
+
+
+def test_stream_trozos_vacios_no_llegan():
+    adv, _, _ = _asesor(FakeModelo(['Hola', '', None, ' mundo']))
+
+    async def run():
+        return [t async for t in adv.chat_stream('hola', [])]
+    assert asyncio.run(run()) == ['Hola', ' mundo']
+
+
+def test_aclose_a_medias_limpia_en_curso():
+    adv, _, _ = _asesor(FakeModeloLento([f'trozo {i} ' for i in range(20)]))
+
+    async def run():
+        gen = adv.chat_stream('cómoda', [])
+        primero = await gen.__anext__()
+        assert adv._en_curso  # la respuesta está en marcha
+        await gen.aclose()
+        return primero
+    assert asyncio.run(run()) == 'trozo 0 '
+    assert adv._en_curso == {}
+    assert adv.metricas()['respuestas']['size'] == 0  # una respuesta a medias no se cachea
+
+
+# ---------- Caché de respuestas ----------
+
+def test_cache_normaliza_y_acierta():
+    adv, modelo, _ = _asesor()
+
+    async def run():
+        a = await adv.chat('¿Tenéis cómodas?', [])
+        b = await adv.chat('teneis  comodas', [])
+        return a, b
+    a, b = asyncio.run(run())
+    assert a == b == 'Le recomiendo la cómoda [ID:9].'
+    assert len(modelo.enviados) == 1
+    assert adv.metricas()['respuestas']['hits'] == 1
+
+
+def test_cache_depende_del_historial():
+    adv, modelo, _ = _asesor()
+    historial = [{'role': 'user', 'content': 'busco algo de nogal'},
+                 {'role': 'assistant', 'content': 'Tenemos la [ID:9]'}]
+
+    async def run():
+        await adv.chat('teneis comodas', [])
+        await adv.chat('teneis comodas', historial)
+    asyncio.run(run())
+    assert len(modelo.enviados) == 2
+
+
+def test_vender_pieza_citada_borra_la_respuesta():
+    adv, modelo, _ = _asesor()
+
+    async def run():
+        await adv.chat('teneis comodas', [])
+        adv.invalidar_inventario([8])   # otra pieza: la respuesta sigue
+        assert adv.metricas()['respuestas']['size'] == 1
+        adv.invalidar_inventario([9])   # la citada con [ID:9]
+        assert adv.metricas()['respuestas']['size'] == 0
+        await adv.chat('teneis comodas', [])
+    asyncio.run(run())
+    assert len(modelo.enviados) == 2
+
+
+def test_preguntas_iguales_en_curso_se_coalescen():
+    adv, _, _ = _asesor(FakeModeloLento(['Mire ', 'la [ID:9]'], pausa=0.05))
+    llamadas = []
+    original = adv._chat
+
+    def contar(history):
+        llamadas.append(1)
+        return original(history)
+    adv._chat = contar
+
+    async def run():
+        return await asyncio.gather(adv.chat('¿cómodas?', []), adv.chat('comodas', []))
+    assert asyncio.run(run()) == ['Mire la [ID:9]'] * 2
+    assert len(llamadas) == 1
+
+
+def test_si_el_primero_se_va_el_que_espera_recibe_respuesta():
+    adv, _, _ = _asesor(FakeModeloLento(['Mire ', 'la ', '[ID:9]'], pausa=0.05))
+
+    async def run():
+        primero = adv.chat_stream('¿cómodas?', [])
+        await primero.__anext__()
+        segundo = asyncio.create_task(adv.chat('comodas', []))
+        await asyncio.sleep(0.01)  # el segundo ya espera la respuesta del primero
+        await primero.aclose()
+        return await segundo
+    assert asyncio.run(run()) == 'Mire la [ID:9]'
+    assert adv._en_curso == {}
+
+
+def test_error_del_modelo_llega_a_quien_espera():
+    class Roto(FakeModeloLento):
+        def start_chat(self, history):
+            class _Chat:
+                def send_message(self, mensaje, stream=False):
+                    import time
+                    time.sleep(0.05)
+                    raise ValueError('modelo caído')
+                    yield
+            return _Chat()
+    adv, _, _ = _asesor(Roto([]))
+
+    async def run():
+        return await asyncio.gather(adv.chat('comodas', []), adv.chat('¿cómodas?', []),
+                                    return_exceptions=True)
+    res = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in res)
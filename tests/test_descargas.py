@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+import pytest
+
+from descargas import Descargador
+
+
+def _descargador(handler, **kw):
+    kw.setdefault('backoff', 0)
+    return Descargador(transport=httpx.MockTransport(handler), **kw)
+
+
+def _secuencia(*codigos):
+    """Handler que responde los códigos dados en orden y anota cuántas peticiones llegan."""
+    llamadas = []
+
+    def handler(request):
+        llamadas.append(request.url)
+        return httpx.Response(codigos[min(len(llamadas), len(codigos)) - 1], content=b'ok')
+    return handler, llamadas
+
+
+@pytest.mark.parametrize('codigo', [503, 429])
+def test_reintenta_hasta_exito(codigo):
+    handler, llamadas = _secuencia(codigo, codigo, 200)
+    d = _descargador(handler, reintentos=3)
+
+    async def run():
+        try:
+            return await d.get_bytes('https://r2.example/a.webp')
+        finally:
+            await d.cerrar()
+    assert asyncio.run(run()) == b'ok'
+    assert len(llamadas) == 3
+
+
+def test_se_rinde_tras_reintentos():
+    handler, llamadas = _secuencia(503)
+    d = _descargador(handler, reintentos=2)
+
+    async def run():
+        try:
+            await d.get('https://r2.example/a.webp')
+        finally:
+            await d.cerrar()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+    assert len(llamadas) == 3  # el intento inicial + 2 reintentos
+
+
+def test_no_reintenta_404():
+    handler, llamadas = _secuencia(404)
+    d = _descargador(handler, reintentos=3)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(d.get('https://r2.example/no.webp'))
+    assert len(llamadas) == 1
+
+
+def test_reintenta_errores_de_red():
+    fallos = [httpx.ConnectError('caída')]
+
+    def handler(request):
+        if fallos:
+            raise fallos.pop()
+        return httpx.Response(200, content=b'ok')
+    d = _descargador(handler, reintentos=1)
+    assert asyncio.run(d.get_bytes('https://r2.example/a.webp')) == b'ok'
+
+
+def test_tope_de_concurrencia():
+    activas, maximo = 0, 0
+
+    async def handler(request):
+        nonlocal activas, maximo
+        activas += 1
+        maximo = max(maximo, activas)
+        await asyncio.sleep(0.01)
+        activas -= 1
+        return httpx.Response(200, content=b'ok')
+    d = _descargador(handler, max_concurrencia=3)
+
+    async def run():
+        try:
+            await asyncio.gather(*(d.get(f'https://r2.example/{i}.webp') for i in range(12)))
+        finally:
+            await d.cerrar()
+    asyncio.run(run())
+    assert maximo == 3
@@ -0,0 +1,48 @@
+import asyncio
+
+from conftest import fila_mueble
+
+
+def _tanda(main, cliente, **kw):
+    async def run():
+        with cliente:
+            contenedor = main.ui.column()
+            return await main.cargar_tanda(contenedor, vendidos=False, tienda='Todas', tipo='Todos',
+                                           nombre_like=None, orden='Más reciente',
+                                           base_origin='https://example.test', **kw)
+    return asyncio.run(run())
+
+
+def test_una_consulta_por_tanda(main_mod, fake_pool, cliente):
+    filas = [fila_mueble(i) for i in range(100, 0, -1)]
+
+    def responder(kind, sql, args):
+        return filas[:main_mod.PAGE_SIZE + 1] if 'FROM muebles m' in sql else None
+    fake_pool.responder = responder
+
+    hay_mas, cursor = _tanda(main_mod, cliente)
+    assert hay_mas and cursor
+    assert fake_pool.count() == 1
+
+    # 'Cargar más': la siguiente tanda usa el cursor y sigue siendo una sola consulta
+    filas = filas[main_mod.PAGE_SIZE:]
+    fake_pool.calls.clear()
+    hay_mas, cursor2 = _tanda(main_mod, cliente, cursor=cursor)
+    assert fake_pool.count() == 1
+    assert cursor2 != cursor
+
+
+def test_ultima_tanda_sin_mas(main_mod, fake_pool, cliente):
+    fake_pool.responder = lambda kind, sql, args: [fila_mueble(i) for i in (3, 2, 1)]
+    hay_mas, cursor = _tanda(main_mod, cliente)
+    assert not hay_mas
+    assert main_mod._decode_cursor(cursor, 'Más reciente')  # apunta a la última fila pintada
+
+
+def test_pintar_filas_no_consulta(main_mod, fake_pool, cliente):
+    async def run():
+        with cliente:
+            await main_mod.pintar_listado(rows=[fila_mueble(i) for i in range(30)],
+                                          base_origin='https://example.test')
+    asyncio.run(run())
+    assert fake_pool.calls == []
@@ -0,0 +1,31 @@
+import warnings
+
+from starlette.testclient import TestClient
+
+BOT = {'user-agent': 'WhatsApp/2.23'}
+
+
+def _cliente(main_mod, fake_pool):
+    fake_pool.responder = lambda kind, sql, args: (
+        {'nombre': 'Cómoda <art déco>', 'precio': 120, 'descripcion': 'Nogal'} if kind == 'fetchrow' else None)
+    main_mod.OG_PAGE_CACHE.clear()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return TestClient(main_mod.app)
+
+
+def test_og_url_es_la_de_la_peticion(main_mod, fake_pool):
+    c = _cliente(main_mod, fake_pool)
+    for v in ('111', '222'):
+        r = c.get(f'/o/5?v={v}', headers=BOT, follow_redirects=False)
+        assert r.status_code == 200
+        assert f'<meta property="og:url" content="http://testserver/o/5?v={v}">' in r.text
+        assert 'Cómoda &lt;art déco&gt;' in r.text
+    assert fake_pool.count() == 1  # el HTML sale de la caché por versión de fila
+
+
+def test_personas_redirigidas_sin_bd(main_mod, fake_pool):
+    c = _cliente(main_mod, fake_pool)
+    r = c.get('/o/5', headers={'user-agent': 'Mozilla/5.0'}, follow_redirects=False)
+    assert r.status_code == 302 and r.headers['location'].endswith('/?id=5')
+    assert fake_pool.calls == []
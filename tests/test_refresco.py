@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+
+def _controlador(main_mod, espera=0.05):
+    hechos = []
+
+    async def refrescar():
+        await asyncio.sleep(espera)
+        hechos.append(1)
+    return main_mod.RefrescoControlador(refrescar), hechos
+
+
+def test_debounce_un_solo_refresco(main_mod):
+    async def run():
+        ctrl, hechos = _controlador(main_mod, espera=0)
+        for _ in range(5):
+            ctrl.programar(0.02)
+        await asyncio.sleep(0.1)
+        return hechos
+    assert asyncio.run(run()) == [1]
+
+
+def test_ahora_sustituido_no_falla(main_mod):
+    async def run():
+        ctrl, hechos = _controlador(main_mod)
+        espera = asyncio.create_task(ctrl.ahora())
+        await asyncio.sleep(0.01)
+        ctrl.programar(0)  # otro refresco sustituye al de ahora()
+        await espera
+        await asyncio.sleep(0.1)
+        return hechos
+    assert asyncio.run(run()) == [1]
+
+
+def test_ahora_propaga_cancelacion_del_llamante(main_mod):
+    async def run():
+        ctrl, _ = _controlador(main_mod)
+        llamante = asyncio.create_task(ctrl.ahora())
+        await asyncio.sleep(0.01)
+        llamante.cancel()
+        await llamante
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run())
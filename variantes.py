@@ -0,0 +1,43 @@
+"""
+Variantes de tamaño de cada imagen en R2 (para srcset).
+
+Junto a la imagen principal `{mid}_{img_id}.webp` (800px) se guardan
+`{mid}_{img_id}_{ancho}.webp` para cada ANCHO y `{mid}_{img_id}_og.jpg`
+(JPEG 1200px para Open Graph). En la BD, `imagenes_muebles.variantes`
+guarda los anchos disponibles; las URLs se derivan de `imagen_url`.
+"""
+
+ANCHOS = (160, 360, 720, 1200)
+
+
+def url(base_url: str, ancho) -> str:
+    """URL de la variante `ancho` (int o 'og') a partir de la URL principal."""
+    raiz, punto, ext = base_url.rpartition('.')
+    if not punto or '/' in ext:
+        raiz, ext = base_url, ''
+    if ancho == 'og':
+        return f'{raiz}_og.jpg'
+    return f'{raiz}_{ancho}.{ext}' if ext else f'{raiz}_{ancho}'
+
+
+def parse(valor) -> tuple:
+    """Anchos desde un int[] de asyncpg o el texto '160,360,…' de array_to_string."""
+    if not valor:
+        return ()
+    if isinstance(valor, str):
+        valor = [v for v in valor.split(',') if v.strip()]
+    return tuple(sorted(int(v) for v in valor))
+
+
+def srcset(base_url: str | None, anchos) -> str:
+    if not base_url or not anchos:
+        return ''
+    return ', '.join(f'{url(base_url, w)} {w}w' for w in anchos)
+
+
+def mejor(base_url: str, anchos, minimo: int) -> str:
+    """La variante más pequeña que cubra `minimo` px; si no hay, la principal."""
+    for w in anchos:
+        if w >= minimo:
+            return url(base_url, w)
+    return base_url